@@ -1,112 +1,331 @@
+import hashlib
+import multiprocessing as mp
+import os
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from scipy.optimize import minimize
 from tabulate import tabulate
+from results import ResultStore, gap_key, time_to_target, typed_history
+
+OPTIMAL_CACHE_DIR = 'Data/.cache/optimal'
 
 class BenchmarkSolver:
+    options = {
+        'disp': 1,
+        'ftol': 1e-16,
+        'gtol': 1e-8,
+        'maxiter': 10000
+    }
+    
     @staticmethod
-    def find_optimal(problem, x0):
+    def cache_path(problem, x0, cache_dir=OPTIMAL_CACHE_DIR):
+        h = hashlib.sha1(problem.cache_key().encode())
+        h.update(np.ascontiguousarray(x0, dtype=np.float64).tobytes())
+        h.update(repr(sorted(BenchmarkSolver.options.items())).encode())
+        return os.path.join(cache_dir, h.hexdigest() + '.npz')
+    
+    @staticmethod
+    def find_optimal(problem, x0, cache_dir=OPTIMAL_CACHE_DIR):
+        if cache_dir is not None:
+            path = BenchmarkSolver.cache_path(problem, x0, cache_dir)
+            if os.path.exists(path):
+                with np.load(path) as cached:
+                    return cached['x_star'], float(cached['f_star'])
+        
         res = minimize(
             fun=problem.loss,
             x0=x0,
             jac=problem.gradient,
             method='L-BFGS-B',
-            options={
-                'disp': 1,
-                'ftol': 1e-16,
-                'gtol': 1e-8,
-                'maxiter': 10000
-            }
+            options=BenchmarkSolver.options
         )
         if not res.success:
             raise RuntimeError(f"Baseline solver failures: {res.message}")
+        
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.npz')
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, x_star=res.x, f_star=res.fun)
+            os.replace(tmp, path)
         return res.x, res.fun
 
 class ResultAnalyzer:
-    def __init__(self, problem, x0):
+    def __init__(self, problem, x0, optimal=None, cache_dir=OPTIMAL_CACHE_DIR, background=False,
+                 store=None, config=None):
+        """
+        optimal : (x_star, f_star) or None
+            Reference solution; computed with BenchmarkSolver when None
+        cache_dir : str or None
+            On-disk cache of reference solutions, None to always solve
+        background : bool
+            Solve in a separate (spawned) process so that optimizer runs can
+            proceed meanwhile; x_star/f_star block until the solve has
+            finished. The solve then competes with the runs for the CPU, so
+            leave it off when their times are compared
+        store : ResultStore, str or None
+            Every added result is also appended to this store
+        config : dict or None
+            Description of the problem saved with each stored result
+        """
         self.problem = problem
         self.x0 = x0
+        self.cache_dir = cache_dir
+        self.store = ResultStore(store) if isinstance(store, str) else store
+        self.config = config
         self.results = []
-        self.x_star, self.f_star = self._calculate_optimal()
+        if optimal is not None:
+            self._optimal = optimal
+        elif background:
+            # spawned, as forking would copy the operators' thread pools
+            executor = ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context('spawn'))
+            self._optimal = executor.submit(BenchmarkSolver.find_optimal, problem, x0, cache_dir)
+            executor.shutdown(wait=False)
+        else:
+            self._optimal = self._calculate_optimal()
     
     def _calculate_optimal(self):
-        return BenchmarkSolver.find_optimal(self.problem, self.x0)
+        return BenchmarkSolver.find_optimal(self.problem, self.x0, self.cache_dir)
+    
+    def _resolve_optimal(self):
+        if isinstance(self._optimal, Future):
+            self._optimal = self._optimal.result()
+        return self._optimal
+    
+    @property
+    def x_star(self):
+        return self._resolve_optimal()[0]
+    
+    @property
+    def f_star(self):
+        return self._resolve_optimal()[1]
     
-    def add_result(self, name, run_time, history):
-        self.results.append({
+    @classmethod
+    def open(cls, store, f_star=None, **filters):
+        """
+        Analyzer over the runs of a ResultStore (or its directory) matching the
+        ResultStore.query filters. Histories are read only when needed, e.g.
+        by plot_convergence. f_star defaults to the value stored with each run,
+        or to its cached reference solution
+        """
+        store = ResultStore(store) if isinstance(store, str) else store
+        analyzer = cls(None, None, optimal=(None, np.nan if f_star is None else f_star), store=store)
+        for record in store.query(**filters):
+            res = {key: record.get(key) for key in
+                   ('name', 'iterations', 'run_time', 'cpu_time', 'final_grad_norm', 'final_loss',
+                    'final_loss_fp64', 'id')}
+            res['counts'] = record.get('counts', {})
+            res['history'] = store.history(record)
+            if f_star is None:
+                res['f_star'] = cls._stored_f_star(record)
+                # computed against the stored f_star, so only valid without an override
+                res['time_to_target'] = record.get('time_to_target')
+            analyzer.results.append(res)
+        return analyzer
+    
+    @staticmethod
+    def _stored_f_star(record):
+        if record.get('f_star') is not None:
+            return record['f_star']
+        path = record.get('optimal_path')
+        if path and os.path.exists(path):
+            with np.load(path) as cached:
+                return float(cached['f_star'])
+        return np.nan
+    
+    def _f_star(self, res):
+        return res['f_star'] if res.get('f_star') is not None else self.f_star
+    
+    def add_result(self, name, run_time, history, params=None):
+        """
+        params : dict or None
+            Optimizer parameters, saved with the result when there is a store
+        """
+        history = typed_history(history)
+        stats = history.get('stats', {})
+        res = {
             'name': name,
-            'iterations': len(history['losses']),
+            'iterations': history.get('n_iter', len(history['losses'])),
             'run_time': run_time,
-            'final_grad_norm': history['grad_norms'][-1],
-            'final_loss': history['losses'][-1],
+            'cpu_time': stats.get('cpu_time'),
+            'counts': stats.get('counts', {}),
+            'final_grad_norm': history['final_grad_norm'] if 'final_grad_norm' in history
+                               else history['grad_norms'][-1] if len(history['grad_norms']) else np.nan,
+            'final_loss': history.get('final_loss', history['losses'][-1] if len(history['losses']) else np.nan),
+            'final_loss_fp64': history.get('final_loss_fp64'),
             'history': history
-        })
+        }
+        if self.store is not None:
+            res['id'] = self.store.append(name, run_time, history, params=params, config=self.config,
+                                          **self._optimal_meta())
+        self.results.append(res)
+    
+    def _optimal_meta(self):
+        # f_star if already known, otherwise where the reference solution will be cached
+        if not isinstance(self._optimal, Future) or self._optimal.done():
+            return {'f_star': self.f_star}
+        if self.cache_dir is None or self.problem is None:
+            return {}
+        return {'optimal_path': BenchmarkSolver.cache_path(self.problem, self.x0, self.cache_dir)}
     
-    def print_table(self):
+    @staticmethod
+    def logged_iterations(history):
+        # histories recorded with a stride carry the iteration numbers in 'iters'
+        if 'iters' in history:
+            return np.asarray(history['iters'])
+        return np.arange(1, len(history['losses'])+1)
+    
+    def time_to_target(self, res, target_gap):
+        # wall time of the first logged iteration whose gap is below target_gap;
+        # stored runs answer the gaps of results.TARGET_GAPS from their record
+        stored = res.get('time_to_target') or {}
+        if gap_key(target_gap) in stored and float(gap_key(target_gap)) == target_gap:
+            return stored[gap_key(target_gap)]
+        history = res['history']
+        if 'times' not in history:
+            return None
+        return time_to_target(history['times'], history['losses'], self._f_star(res), target_gap)
+    
+    def print_table(self, target_gap=1e-6):
+        fmt = lambda value, spec: '-' if value is None else format(value, spec)
+        # runs at reduced precision carry their final loss re-evaluated in float64
+        fp64 = any(res.get('final_loss_fp64') is not None for res in self.results)
         table = []
         for res in self.results:
+            counts = res['counts']
             table.append([
                 res['name'],
                 res['iterations'],
                 f"{res['run_time']:.6f}",
+                fmt(res['cpu_time'], '.6f'),
+                fmt(self.time_to_target(res, target_gap), '.6f'),
+                counts.get('loss', 0) + counts.get('loss_and_gradient', 0),
+                counts.get('gradient', 0) + counts.get('loss_and_gradient', 0),
+                counts.get('hvp', 0),
+                counts.get('matvecs', 0),
                 f"{res['final_grad_norm']:.6e}",
                 f"{res['final_loss']:.6e}",
-                f"{res['final_loss'] - self.f_star:.6e}"
+                f"{res['final_loss'] - self._f_star(res):.6e}"
             ])
-        print(tabulate(table, 
-            headers=["Algorithm", "Iterations", "CPU time", "Grad Norm", "Loss", "Optimality Gap"],
-            tablefmt="github"))
+            if fp64:
+                loss_fp64 = res.get('final_loss_fp64')
+                table[-1].append(fmt(None if loss_fp64 is None else loss_fp64 - self._f_star(res), '.6e'))
+        headers = ["Algorithm", "Iterations", "Wall time", "CPU time", f"Time to {target_gap:.0e}",
+                   "Loss evals", "Grad evals", "HVPs", "Matvecs", "Grad Norm", "Loss", "Optimality Gap"]
+        if fp64:
+            headers.append("Gap (fp64)")
+        print(tabulate(table, headers=headers, tablefmt="github"))
+    
+    def convergence_curves(self, max_points=2000):
+        """
+        (name, iterations, gaps) of the first 10 results, decimated to about
+        max_points each, and the largest iteration count
+        """
+        curves = []
+        for res in self.results[:10]:
+            gaps = np.asarray(res['history']['losses']) - self._f_star(res)
+            iterations = self.logged_iterations(res['history'])
+            logged = np.isfinite(gaps)
+            curves.append((res['name'], *decimate(iterations[logged], gaps[logged], max_points)))
+        max_iter = max(res['iterations'] for res in self.results)
+        return curves, max_iter
     
-    def plot_convergence(self):
+    def plot_convergence(self, path=None, max_points=2000):
+        """
+        Show the convergence plot, or with path set, write it to that file
+        off-screen (no display needed). Curves are decimated to about
+        max_points points, see decimate
+        """
+        curves, max_iter = self.convergence_curves(max_points)
+        if path is not None:
+            render_convergence(path, curves, max_iter)
+            return
         plt.figure(figsize=(10, 6))
-        
-        # 动态生成颜色，最多10个
-        num_results = min(len(self.results), 10)  # 限制最大10条线
-        
-            # 定义8种低调但有区分度的颜色
-        base_color_pool = [
-            '#1E90FF',  # 道奇蓝
-            '#2F4F4F',  # 暗板岩灰
-            '#9932CC',  # 暗兰花紫
-            '#8B4513',  # 鞍褐
-            '#228B22',  # 森林绿
-            '#D2691E',  # 巧克力色
-            '#483D8B',  # 暗石板蓝
-            '#CD5C5C',  # 印度红
-        ]
-    
-        # 最后两个显眼的颜色
-        highlight_colors = ['#FFA500', '#FF0000']  # 橙色和红色
-    
-        # 根据结果数量选择颜色
-        if num_results <= 2:
-            colors = highlight_colors[:num_results]  # 1或2个结果时只用显眼色
-        else:
-            num_base = min(num_results - 2, 8)  # 最多8个低调色
-            base_colors = base_color_pool[:num_base]
-            colors = base_colors + highlight_colors[:(num_results - num_base)]
-            
-        # 绘制每条曲线
-        for idx, res in enumerate(self.results[:10]):  # 限制最多10条
-            gaps = np.array(res['history']['losses']) - self.f_star
-            iterations = np.arange(1, len(gaps)+1)
-    
-            plt.semilogy(iterations, gaps, label=res['name'], color=colors[idx])
-            
-#       plt.title("Convergence Analysis", fontsize=14)
-        plt.xlabel("Iteration", fontsize=12)
-        plt.ylabel(r"$f(x) - f^*$", fontsize=12)
-        
-        max_iter = max(len(res['history']['losses']) for res in self.results)
-        plt.xticks(
-            ticks=np.arange(1, max_iter+1, step=max(1, max_iter//10)),
-            labels=np.arange(1, max_iter+1, step=max(1, max_iter//10)).astype(int)
-        )
-        
-        plt.grid(True, which='both', linestyle='--', alpha=0.7)
-        plt.legend(fontsize=10)
-        
-        plt.xlim(left=0.5, right=max_iter+0.5)
-        
+        _draw_convergence(plt.gca(), curves, max_iter)
         plt.tight_layout()
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+def decimate(x, y, max_points=2000):
+    """
+    Shape-preserving downsampling of a curve with increasing x to about
+    max_points points: the x range is cut into max_points/4 equal buckets and
+    each keeps its first, last, lowest and highest point. Extremes do not
+    change under the log scale of the y axis, so spikes and plateaus of a
+    semilogy plot survive unchanged
+    """
+    n = len(x)
+    if n <= max_points:
+        return x, y
+    buckets = max(1, max_points // 4)
+    edges = np.linspace(x[0], x[-1], buckets + 1)
+    ids = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, buckets - 1)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends = np.r_[starts[1:], n] - 1
+    # within each bucket, sorted by y: the first is the minimum, the last the maximum
+    order = np.lexsort((y, ids))
+    keep = np.unique(np.concatenate([starts, ends, order[starts], order[ends]]))
+    return x[keep], y[keep]
+
+def _curve_colors(num_results):
+    # 定义8种低调但有区分度的颜色
+    base_color_pool = [
+        '#1E90FF',  # 道奇蓝
+        '#2F4F4F',  # 暗板岩灰
+        '#9932CC',  # 暗兰花紫
+        '#8B4513',  # 鞍褐
+        '#228B22',  # 森林绿
+        '#D2691E',  # 巧克力色
+        '#483D8B',  # 暗石板蓝
+        '#CD5C5C',  # 印度红
+    ]
+    
+    # 最后两个显眼的颜色
+    highlight_colors = ['#FFA500', '#FF0000']  # 橙色和红色
+    
+    # 根据结果数量选择颜色
+    if num_results <= 2:
+        return highlight_colors[:num_results]  # 1或2个结果时只用显眼色
+    num_base = min(num_results - 2, 8)  # 最多8个低调色
+    return base_color_pool[:num_base] + highlight_colors[:(num_results - num_base)]
+
+def _draw_convergence(ax, curves, max_iter):
+    # 绘制每条曲线
+    for (name, iterations, gaps), color in zip(curves, _curve_colors(len(curves))):
+        ax.semilogy(iterations, gaps, label=name, color=color)
+
+#   ax.set_title("Convergence Analysis", fontsize=14)
+    ax.set_xlabel("Iteration", fontsize=12)
+    ax.set_ylabel(r"$f(x) - f^*$", fontsize=12)
+    
+    ticks = np.arange(1, max_iter+1, step=max(1, max_iter//10))
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(ticks.astype(int))
+    
+    ax.grid(True, which='both', linestyle='--', alpha=0.7)
+    ax.legend(fontsize=10)
+    
+    ax.set_xlim(left=0.5, right=max_iter+0.5)
+
+def render_convergence(path, curves, max_iter):
+    # draws on a bare Agg canvas: no pyplot state, no display
+    fig = Figure(figsize=(10, 6))
+    FigureCanvasAgg(fig)
+    _draw_convergence(fig.add_subplot(), curves, max_iter)
+    fig.tight_layout()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fig.savefig(path)
+
+def render_convergence_plots(analyzers, workers=None, max_points=2000):
+    """
+    Write the convergence plots of {path: ResultAnalyzer} to image files on a
+    process pool. The curves are decimated here, so workers only receive a
+    few thousand points per curve and never the problems themselves
+    """
+    paths = list(analyzers)
+    jobs = [analyzers[path].convergence_curves(max_points) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn')) as pool:
+        list(pool.map(render_convergence, paths, *zip(*jobs)))
@@ -0,0 +1,261 @@
+import numpy as np
+from optimizers import Optimizer
+
+class BatchedOptimizer(Optimizer):
+    """
+    Advances k independent instances in lockstep, one per column of X0, so that
+    each oracle call is a single matrix-matrix product (see
+    Problem.loss_and_gradient_batch). Instances share A and b and may differ in
+    their starting point and in the problem's key_params, given per column to
+    optimize as column_params (e.g. l=[1e-5, 1e-6, 1e-7]). Step sizes may be
+    given per column as well.
+
+    A column whose gradient norm drops below gtol is frozen: it is neither
+    updated nor evaluated again. Of the Monitor, only log_every, log_loss and
+    time_budget apply to a batch.
+
+    History values are per column: 'losses' and 'grad_norms' are arrays of shape
+    (n_logged, k), NaN for columns not evaluated at that iteration; 'n_iter',
+    'final_loss' and 'final_grad_norm' have shape (k,), and 'converged' marks the
+    columns that reached gtol.
+    """
+    def _start_batch(self, problem, X0, monitor, column_params):
+        problem, history = self._start(problem, monitor)
+        k = X0.shape[1]
+        history.update({
+            'n_iter': np.zeros(k, dtype=int),
+            'final_loss': np.full(k, np.nan),
+            'final_grad_norm': np.full(k, np.nan),
+            'converged': np.zeros(k, dtype=bool),
+        })
+        params = {name: np.broadcast_to(np.asarray(value, dtype=np.float64), (k,))
+                  for name, value in (column_params or {}).items()}
+        return problem, history, params
+    
+    def _per_column(self, name, k):
+        return np.broadcast_to(np.asarray(self.params[name], dtype=np.float64), (k,)).copy()
+    
+    def _wants_loss(self, it):
+        # the loss of the last iteration is always recorded
+        return self.monitor.wants_loss(it) or it >= self.params['max_iter']
+    
+    def _evaluate_batch(self, problem, X, cols, params, it, with_loss=None):
+        # losses (or None) and gradients of the columns cols of X
+        sub = {name: value[cols] for name, value in params.items()}
+        if with_loss is None:
+            with_loss = self._wants_loss(it)
+        if with_loss:
+            return problem.loss_and_gradient_batch(X[:, cols], **sub)
+        return None, problem.gradient_batch(X[:, cols], **sub)
+    
+    def _log_batch(self, history, it, cols, losses, grads):
+        # records iteration it for the columns cols, freezes the converged ones,
+        # and returns True when the whole batch should stop
+        with self._phase('bookkeeping'):
+            k = len(history['n_iter'])
+            grad_norms = np.linalg.norm(grads, axis=0)
+            history['n_iter'][cols] = it
+            history['final_grad_norm'][cols] = grad_norms
+            if losses is not None:
+                history['final_loss'][cols] = losses
+            history['converged'][cols] = grad_norms < self.params['gtol']
+            elapsed = self.instrumentation.elapsed()
+            
+            reason = None
+            if history['converged'].all():
+                reason = 'gtol'
+            elif self.monitor.time_budget is not None and elapsed >= self.monitor.time_budget:
+                reason = 'time_budget'
+            elif it >= self.params['max_iter']:
+                reason = 'max_iter'
+            
+            if self.monitor.logs(it) or reason is not None:
+                row_losses = np.full(k, np.nan)
+                if losses is not None:
+                    row_losses[cols] = losses
+                row_grad_norms = np.full(k, np.nan)
+                row_grad_norms[cols] = grad_norms
+                history['iters'].append(it)
+                history['losses'].append(row_losses)
+                history['grad_norms'].append(row_grad_norms)
+                if 'times' in history:
+                    history['times'].append(elapsed)
+            if reason is not None:
+                history['stop_reason'] = reason
+        return reason is not None
+    
+    def _finish_batch(self, history):
+        k = len(history['n_iter'])
+        history['losses'] = np.array(history['losses']).reshape(-1, k)
+        history['grad_norms'] = np.array(history['grad_norms']).reshape(-1, k)
+        return self._finish(history)
+
+class BatchedGradientDescent(BatchedOptimizer):
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.params.setdefault('lr', 1e-4)
+        self.params.setdefault('max_iter', 10000)
+        self.params.setdefault('gtol', 1e-6)
+    
+    def optimize(self, problem, X0, monitor=None, column_params=None):
+        problem, history, params = self._start_batch(problem, X0, monitor, column_params)
+        
+        X = np.array(X0, dtype=np.float64)
+        k = X.shape[1]
+        lr = self._per_column('lr', k)
+        _, G = self._evaluate_batch(problem, X, np.arange(k), params, 1, with_loss=False)
+        
+        for it in range(1, self.params['max_iter']+1):
+            cols = np.flatnonzero(~history['converged'])
+            with self._phase('update'):
+                X[:, cols] -= lr[cols] * G[:, cols]
+            losses, G[:, cols] = self._evaluate_batch(problem, X, cols, params, it)
+            
+            if self._log_batch(history, it, cols, losses, G[:, cols]):
+                break
+        
+        run_time = self._finish_batch(history)
+        
+        return X, run_time, history
+
+class BatchedAdam(BatchedOptimizer):
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.params.setdefault('lr', 1e-4)
+        self.params.setdefault('beta1', 0.9)
+        self.params.setdefault('beta2', 0.999)
+        self.params.setdefault('eps', 1e-8)
+        self.params.setdefault('max_iter', 10000)
+        self.params.setdefault('gtol', 1e-6)
+    
+    def optimize(self, problem, X0, monitor=None, column_params=None):
+        problem, history, params = self._start_batch(problem, X0, monitor, column_params)
+        
+        X = np.array(X0, dtype=np.float64)
+        k = X.shape[1]
+        lr = self._per_column('lr', k)
+        beta1, beta2, eps = self.params['beta1'], self.params['beta2'], self.params['eps']
+        M = np.zeros_like(X)
+        V = np.zeros_like(X)
+        _, G = self._evaluate_batch(problem, X, np.arange(k), params, 1, with_loss=False)
+        
+        for t in range(1, self.params['max_iter']+1):
+            cols = np.flatnonzero(~history['converged'])
+            with self._phase('update'):
+                # same arithmetic as kernels.adam_step, column-wise
+                g = G[:, cols]
+                M[:, cols] = beta1 * M[:, cols] + (1 - beta1) * g
+                V[:, cols] = beta2 * V[:, cols] + (1 - beta2) * g * g
+                denom = np.sqrt(V[:, cols] * (1 / (1 - beta2**t)) + eps)
+                X[:, cols] -= (lr[cols] / (1 - beta1**t)) * (M[:, cols] / denom)
+            losses, G[:, cols] = self._evaluate_batch(problem, X, cols, params, t)
+            
+            if self._log_batch(history, t, cols, losses, G[:, cols]):
+                break
+        
+        run_time = self._finish_batch(history)
+        
+        return X, run_time, history
+
+class BatchedAIM(BatchedOptimizer):
+    """
+    AIM on a batch, with beta and mu kept per column. In the line search,
+    columns that accepted their step drop out of the following trials
+    """
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.params.setdefault('initial_lr', 1e-4)
+        self.params.setdefault('mtype', 'Hg')
+        self.params.setdefault('beta', 1.0)
+        self.params.setdefault('eta', 0.9)
+        self.params.setdefault('mu', 0.75)
+        self.params.setdefault('eps', 1e-3)
+        self.params.setdefault('exact_hvp', True)
+        self.params.setdefault('max_iter', 10000)
+        self.params.setdefault('mtol', 1e-8)
+        self.params.setdefault('gtol', 1e-6)
+    
+    def _momentum(self, problem, X, X_ref, G, G_pre, cols, params, beta, mu):
+        # the unnormalized direction m of every column in cols (and, for 'QN', mu)
+        mtype, eps, eta = self.params['mtype'], self.params['eps'], self.params['eta']
+        if mtype == 'v':
+            return X[:, cols] - X_ref[:, cols]
+        if mtype == 'a':
+            return G[:, cols] - G_pre[:, cols]
+        if mtype == 'QN':
+            S = X[:, cols] - X_ref[:, cols]
+            Y = G[:, cols] - G_pre[:, cols]
+            alpha = np.maximum(np.einsum('ij,ij->j', S, S) / np.abs(np.einsum('ij,ij->j', S, Y)),
+                               beta[cols] / eta) * 1.1
+            Y *= alpha
+            M = Y - S
+            mu[cols] = np.einsum('ij,ij->j', M, M) / np.einsum('ij,ij->j', M, Y)
+            return M
+        if mtype == 'Hg':
+            sub = {name: value[cols] for name, value in params.items()}
+            if self.params['exact_hvp'] and problem.has_hvp:
+                return problem.hessian_vector_product_batch(X[:, cols], G[:, cols], **sub)
+            return (G[:, cols] - problem.gradient_batch(X[:, cols] - eps * G[:, cols], **sub)) / eps
+        raise ValueError(f"unknown mtype {mtype!r}")
+    
+    def optimize(self, problem, X0, monitor=None, column_params=None):
+        problem, history, params = self._start_batch(problem, X0, monitor, column_params)
+        
+        X = np.array(X0, dtype=np.float64)
+        k = X.shape[1]
+        # the 'v' and 'QN' directions are measured from the starting point
+        X_ref = X.copy()
+        beta = self._per_column('beta', k)
+        mu = self._per_column('mu', k)
+        eta = self.params['eta']
+        
+        _, G_pre = self._evaluate_batch(problem, X, np.arange(k), params, 1, with_loss=False)
+        X -= self._per_column('initial_lr', k) * G_pre
+        losses, G = self._evaluate_batch(problem, X, np.arange(k), params, 1)
+        X_nxt = np.empty_like(X)
+        G_nxt = np.empty_like(X)
+        cols = np.arange(k)
+        
+        for it in range(1, self.params['max_iter']+1):
+            if self._log_batch(history, it, cols, losses, G[:, cols]):
+                break
+            cols = np.flatnonzero(~history['converged'])
+            
+            with self._phase('direction'):
+                M = self._momentum(problem, X, X_ref, G, G_pre, cols, params, beta, mu)
+                norm_M = np.linalg.norm(M, axis=0)
+                large = norm_M > self.params['mtol']
+                M[:, large] /= norm_M[large]
+                M[:, ~large] = 0.0
+                D = G[:, cols] - (mu[cols] * np.einsum('ij,ij->j', M, G[:, cols])) * M
+            
+            with self._phase('line_search'):
+                # pending holds positions within cols that are still searching
+                losses = np.full(len(cols), np.nan) if self._wants_loss(it + 1) else None
+                pending = np.arange(len(cols))
+                while len(pending):
+                    idx = cols[pending]
+                    X_nxt[:, idx] = X[:, idx] - beta[idx] * D[:, pending]
+                    trial_losses, G_nxt[:, idx] = self._evaluate_batch(problem, X_nxt, idx, params, it + 1)
+                    if losses is not None:
+                        losses[pending] = trial_losses
+                    
+                    dX = X[:, idx] - X_nxt[:, idx]
+                    dG = G[:, idx] - G_nxt[:, idx]
+                    r_u = np.einsum('ij,ij->j', dX, dG) * beta[idx]
+                    r_d = np.einsum('ij,ij->j', dX, dX) + mu[idx] / (1 - mu[idx]) * np.einsum('ij,ij->j', M[:, pending], dX)**2
+                    r = r_u / r_d
+                    
+                    rejected = r > eta
+                    beta[idx[rejected]] *= np.minimum(1.0, 1.0 / r[rejected]) / 1.5
+                    grow = ~rejected & (r < 0.5)
+                    beta[idx[grow]] = 2.0 * beta[idx[grow]] / (np.maximum(r[grow], 0) + 1e-3)
+                    pending = pending[rejected]
+            
+            G_pre[:, cols] = G[:, cols]
+            X[:, cols] = X_nxt[:, cols]
+            G[:, cols] = G_nxt[:, cols]
+        
+        run_time = self._finish_batch(history)
+        
+        return X, run_time, history
@@ -0,0 +1,33 @@
+import json
+import os
+import tempfile
+import numpy as np
+
+def _number(value):
+    # numpy scalars in meta (e.g. float32 values at reduced precision) are written as Python numbers
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def save_checkpoint(path, meta, arrays):
+    """
+    Atomically write a checkpoint: meta is a JSON-serializable dict (floats
+    round-trip exactly), arrays maps names to ndarrays stored as-is
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.npz')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, __meta__=np.array(json.dumps(meta, default=_number)), **arrays)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+def load_checkpoint(path):
+    # (meta, arrays) as written by save_checkpoint
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['__meta__']))
+        arrays = {name: data[name] for name in data.files if name != '__meta__'}
+    return meta, arrays
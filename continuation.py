@@ -0,0 +1,97 @@
+import os
+import numpy as np
+from results import HISTORY_COLUMNS
+
+def geometric_path(start, stop, num):
+    # num values from start to stop, evenly spaced on a log scale
+    return np.geomspace(start, stop, num)
+
+def _merge_stats(stats):
+    # the stats of consecutive runs added up
+    merged = {'wall_time': 0.0, 'cpu_time': 0.0, 'phase_wall': {}, 'phase_cpu': {}, 'counts': {}}
+    for entry in stats:
+        merged['wall_time'] += entry['wall_time']
+        merged['cpu_time'] += entry['cpu_time']
+        for key in ('phase_wall', 'phase_cpu', 'counts'):
+            for name, value in entry[key].items():
+                merged[key][name] = merged[key].get(name, 0) + value
+    return merged
+
+def _stage_checkpoint(path, i):
+    root, ext = os.path.splitext(path)
+    return f"{root}.stage{i}{ext}"
+
+def solve_path(problem, param, values, optimizer, x0, monitor=None, stage_gtol=None, carry_state=False):
+    """
+    Continuation: solve problem.with_params(param=value) for each value in turn,
+    typically decreasing (e.g. l over geometric_path(1e-3, 1e-7, 5), or
+    epsilon of SmoothedLpL2Problem), each solve starting from the solution of
+    the previous one
+        Parameters:
+            problem : Problem
+                param must be one of its key_params
+            values : sequence of float
+                The last value defines the problem that is finally solved
+            optimizer : Optimizer
+                Run once per value, with its own params
+            stage_gtol : float or None
+                gtol of every solve but the last; intermediate solutions only
+                need to be good starting points
+            carry_state : bool (default=False)
+                Also start each solve from the adaptive state the previous one
+                ended with (Optimizer.warm_start), e.g. AIM's beta and mu or
+                Adam's moments. On w8a this saves nothing for AIM, whose beta
+                adapts within a few steps, and slows Adam down. Otherwise, and
+                for the first solve, the optimizer's own warm state is used,
+                which is left as it was
+
+        Returns:
+            x : ndarray (n,)
+                Solution for the last value
+            run_time : float
+                Total over all solves
+            history : dict
+                The histories of the solves one after the other, iterations and
+                times counted from the start of the path; final values,
+                stop_reason and oracle counts as for a single run. 'stages'
+                summarizes every solve (value, n_iter, run_time, final_loss,
+                final_grad_norm)
+    """
+    values = list(values)
+    saved = {name: optimizer.params[name] for name in ('gtol', 'checkpoint')}
+    # warm state set by the caller; every solve that carries nothing over starts from it
+    warm = optimizer._warm
+    x = np.array(x0, dtype=problem.dtype)
+    run_time = 0.0
+    path = {name: [] for name in HISTORY_COLUMNS}
+    stages, stats = [], []
+    try:
+        for i, value in enumerate(values):
+            last = i == len(values) - 1
+            if stage_gtol is not None:
+                optimizer.params['gtol'] = saved['gtol'] if last else stage_gtol
+            if saved['checkpoint'] is not None:
+                optimizer.params['checkpoint'] = _stage_checkpoint(saved['checkpoint'], i)
+            optimizer.warm_start(optimizer.carried_state() if carry_state and i else warm)
+            
+            x, stage_time, history = optimizer.optimize(problem.with_params(**{param: value}), x, monitor)
+            
+            offset = sum(stage['n_iter'] for stage in stages)
+            path['iters'].extend(k + offset for k in history['iters'])
+            path['losses'].extend(history['losses'])
+            path['grad_norms'].extend(history['grad_norms'])
+            if 'times' in history:
+                path['times'].extend(t + run_time for t in history['times'])
+            run_time += stage_time
+            stats.append(history['stats'])
+            stages.append({'value': value, 'n_iter': history['n_iter'], 'run_time': stage_time,
+                           'final_loss': history.get('final_loss'),
+                           'final_grad_norm': history.get('final_grad_norm')})
+    finally:
+        optimizer.params.update(saved)
+        optimizer.warm_start(warm)
+    
+    result = {key: value for key, value in history.items() if key not in path}
+    result.update({name: column for name, column in path.items() if column or name in history})
+    result.update(n_iter=sum(stage['n_iter'] for stage in stages), stages=stages, stats=_merge_stats(stats))
+    return x, run_time, result
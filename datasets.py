@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import scipy.sparse as sp
+
+def file_hash(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# bumped whenever the layout written by save_arrays changes, so that older caches are rebuilt
+CACHE_VERSION = 2
+
+def _index_dtype(A):
+    # int32 indices whenever they fit, the type scipy would convert them to on loading
+    return np.int32 if max(A.shape + (A.nnz,)) < np.iinfo(np.int32).max else np.int64
+
+def save_arrays(directory, A, b, **meta):
+    """
+    Write a design matrix and a label/observation vector as raw .npy files
+        Parameters:
+            directory : str
+                Target directory, replaced atomically once everything is written
+            A : ndarray or scipy.sparse matrix (m, n)
+                Stored as indptr/indices/data when sparse, with int32 indices if
+                they fit (so that loading can map them without a copy), and as
+                one array when dense
+            b : ndarray (m,)
+            **meta :
+                Extra JSON-serializable entries stored in meta.json
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        os.chmod(tmp, 0o755)
+        if sp.issparse(A):
+            A = sp.csr_matrix(A)
+            index_dtype = _index_dtype(A)
+            np.save(os.path.join(tmp, 'indptr.npy'), A.indptr.astype(index_dtype, copy=False))
+            np.save(os.path.join(tmp, 'indices.npy'), A.indices.astype(index_dtype, copy=False))
+            np.save(os.path.join(tmp, 'data.npy'), A.data)
+        else:
+            np.save(os.path.join(tmp, 'dense.npy'), np.ascontiguousarray(A))
+        np.save(os.path.join(tmp, 'labels.npy'), np.asarray(b))
+        meta.update(shape=list(A.shape), sparse=bool(sp.issparse(A)), version=CACHE_VERSION)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(tmp, directory)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+def read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def load_arrays(directory, mmap_mode='r'):
+    """
+    Open a directory written by save_arrays. With mmap_mode set the arrays are
+    memory-mapped, so processes opening the same cache share its pages.
+        Returns:
+            A : scipy.sparse.csr_matrix or ndarray (m, n)
+            b : ndarray (m,)
+    """
+    meta = read_meta(directory)
+    if meta is None:
+        raise FileNotFoundError(f"No dataset cache in {directory}")
+    load = lambda name: np.load(os.path.join(directory, name), mmap_mode=mmap_mode)
+    if meta['sparse']:
+        A = sp.csr_matrix((load('data.npy'), load('indices.npy'), load('indptr.npy')),
+                          shape=tuple(meta['shape']), copy=False)
+    else:
+        A = load('dense.npy')
+    return A, load('labels.npy')
+
+def _sample_distinct(rng, total, k):
+    # k distinct integers from range(total), sorted, in O(k log k) time and O(k)
+    # memory (rng.choice(total, k, replace=False) permutes all of range(total))
+    if 2 * k > total:
+        return np.sort(rng.choice(total, k, replace=False))
+    picked = np.empty(0, dtype=np.int64)
+    while picked.size < k:
+        draw = rng.integers(0, total, size=int(1.1 * (k - picked.size)) + 16, dtype=np.int64)
+        picked = np.concatenate([picked, draw])
+        picked.sort()
+        picked = picked[np.concatenate(([True], picked[1:] != picked[:-1]))]
+    if picked.size > k:
+        picked = np.sort(rng.choice(picked, k, replace=False))
+    return picked
+
+def generate_sparse_regression(m, n, sparsity=0.15, random_seed=42):
+    """
+    Generate sparse regression test data directly in CSR form, in O(nnz) time and memory
+        Parameters:
+            m : int 
+                Number of samples (matrix rows)
+            n : int 
+                Number of features (matrix columns)
+            sparsity : float (default=0.15)
+                Fraction of nonzero entries of A
+            random_seed : int (default=42)
+                Random seed
+        
+        Returns:
+            A : scipy.sparse.csr_matrix (m, n)  Sparse design matrix
+            b : ndarray (m,)                    Observation vector
+    """
+    rng = np.random.default_rng(random_seed)
+    
+    non_zero_num = int(m * n * sparsity)
+    flat_indices = _sample_distinct(rng, m * n, non_zero_num)
+    rows, cols = np.divmod(flat_indices, n)
+    index_dtype = np.int32 if max(m, n, non_zero_num) < np.iinfo(np.int32).max else np.int64
+    indptr = np.zeros(m + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(rows, minlength=m), out=indptr[1:])
+    data = rng.normal(loc=0.0, scale=1.0, size=non_zero_num)
+    A = sp.csr_matrix((data, cols.astype(index_dtype), indptr), shape=(m, n))
+    
+    mask = rng.binomial(1, 0.5, size=n).astype(bool)
+    v = np.zeros(n)
+    v[~mask] = rng.normal(loc=0.0, scale=np.sqrt(1/n), size=np.sum(~mask))
+    
+    delta = rng.normal(loc=0.0, scale=1.0, size=m)
+    
+    b = A @ v + delta
+    
+    return A, b
+
+GENERATED_CACHE_ROOT = 'Data/.cache/generated'
+
+def generated_cache_dir(m, n, sparsity=0.15, random_seed=42, cache_root=GENERATED_CACHE_ROOT):
+    return os.path.join(cache_root, f"m={m},n={n},r={sparsity},seed={random_seed}")
+
+def load_generated(m, n, sparsity=0.15, random_seed=42, cache_root=GENERATED_CACHE_ROOT, mmap_mode='r'):
+    """
+    generate_sparse_regression through an on-disk cache keyed by (m, n, sparsity, seed);
+    cached instances are memory-mapped
+    """
+    directory = generated_cache_dir(m, n, sparsity, random_seed, cache_root)
+    if read_meta(directory) is None:
+        A, b = generate_sparse_regression(m, n, sparsity, random_seed)
+        save_arrays(directory, A, b, m=m, n=n, sparsity=sparsity, random_seed=random_seed)
+    return load_arrays(directory, mmap_mode=mmap_mode)
+
+def default_cache_dir(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '.cache', os.path.basename(path))
+
+def load_svmlight_cached(path, cache_dir=None, n_features=None, mmap_mode='r'):
+    """
+    Load an svmlight file through a binary CSR cache
+
+    The text file is parsed once and written next to it (Data/.cache/<name>
+    by default). Later calls memory-map the cache. The cache is reused while
+    the source file keeps its mtime and size, and otherwise only if its
+    content hash is unchanged.
+        Parameters:
+            path : str
+                svmlight/libsvm file
+            cache_dir : str (default=None)
+                Cache directory for this file
+            n_features : int (default=None)
+                Passed to sklearn's parser when the cache is (re)built
+            mmap_mode : str or None (default='r')
+                None loads the arrays into memory
+
+        Returns:
+            A : scipy.sparse.csr_matrix (m, n)
+            b : ndarray (m,)
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    stat = os.stat(path)
+    meta = read_meta(cache_dir)
+    
+    valid = meta is not None and meta.get('version') == CACHE_VERSION and meta.get('n_features') == n_features
+    if valid and (meta['source_mtime'], meta['source_size']) != (stat.st_mtime, stat.st_size):
+        digest = file_hash(path)
+        valid = meta['source_hash'] == digest
+        if valid:
+            meta.update(source_mtime=stat.st_mtime, source_size=stat.st_size)
+            with open(os.path.join(cache_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+    
+    if not valid:
+        from sklearn.datasets import load_svmlight_file
+        A, b = load_svmlight_file(path, n_features=n_features)
+        A.sort_indices()
+        save_arrays(cache_dir, A, b, source=os.path.abspath(path), source_mtime=stat.st_mtime,
+                    source_size=stat.st_size, source_hash=file_hash(path), n_features=n_features)
+    
+    return load_arrays(cache_dir, mmap_mode=mmap_mode)
@@ -0,0 +1,86 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+class Instrumentation:
+    """
+    Wall and CPU time per phase, plus named counters
+
+    Phases nest exclusively: time spent in an inner phase (e.g. an oracle call
+    inside a line search) is only charged to the inner one. Time outside any
+    phase is reported as 'other'.
+    """
+    def __init__(self):
+        self.wall = defaultdict(float)
+        self.cpu = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._stack = []
+        self._wall_start = self._cpu_start = None
+        self._mark = None
+    
+    @staticmethod
+    def _now():
+        return time.perf_counter(), time.process_time()
+    
+    def _charge(self, now):
+        name = self._stack[-1] if self._stack else 'other'
+        self.wall[name] += now[0] - self._mark[0]
+        self.cpu[name] += now[1] - self._mark[1]
+        self._mark = now
+    
+    def start(self):
+        self._mark = self._now()
+        self._wall_start, self._cpu_start = self._mark
+        return self
+    
+    def stop(self):
+        now = self._now()
+        self._charge(now)
+        self.wall_total = now[0] - self._wall_start
+        self.cpu_total = now[1] - self._cpu_start
+        return self.wall_total
+    
+    def elapsed(self):
+        return time.perf_counter() - self._wall_start
+    
+    @contextmanager
+    def phase(self, name):
+        self._charge(self._now())
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._charge(self._now())
+            self._stack.pop()
+    
+    def state_dict(self):
+        # what a resumed run needs to continue the measurements
+        now = self._now()
+        self._charge(now)
+        return {'wall': dict(self.wall), 'cpu': dict(self.cpu),
+                'counts': {name: int(n) for name, n in self.counts.items()},
+                'wall_elapsed': now[0] - self._wall_start, 'cpu_elapsed': now[1] - self._cpu_start}
+    
+    def load_state_dict(self, state):
+        # continue from a state_dict as if no time had passed since it was taken
+        self.wall.clear()
+        self.wall.update(state['wall'])
+        self.cpu.clear()
+        self.cpu.update(state['cpu'])
+        self.counts.clear()
+        self.counts.update(state['counts'])
+        self._mark = self._now()
+        self._wall_start = self._mark[0] - state['wall_elapsed']
+        self._cpu_start = self._mark[1] - state['cpu_elapsed']
+    
+    def count(self, name, n=1):
+        self.counts[name] += n
+    
+    def summary(self):
+        return {
+            'wall_time': self.wall_total,
+            'cpu_time': self.cpu_total,
+            'phase_wall': dict(self.wall),
+            'phase_cpu': dict(self.cpu),
+            'counts': dict(self.counts),
+        }
@@ -0,0 +1,174 @@
+import numpy as np
+from functools import lru_cache
+from scipy.linalg.blas import get_blas_funcs
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# whether the compiled kernels below exist; callers keep a numpy path otherwise
+COMPILED = njit is not None
+# below this many coordinates the compiled loops run on one thread
+PARALLEL_MIN_SIZE = 1 << 15
+
+@lru_cache(maxsize=None)
+def _blas(name, dtype):
+    return get_blas_funcs(name, dtype=np.dtype(dtype))
+
+def _blas_compatible(*arrays):
+    dtype = arrays[0].dtype
+    return dtype in (np.float32, np.float64) and all(
+        a.ndim == 1 and a.dtype == dtype and a.flags.c_contiguous for a in arrays)
+
+def axpy(alpha, x, y):
+    # y += alpha * x in a single pass without temporaries
+    if _blas_compatible(x, y):
+        _blas('axpy', y.dtype)(x, y, a=alpha)
+    else:
+        y += alpha * x
+    return y
+
+def dot64(x, y):
+    # inner product accumulated in float64 whatever the dtype of x and y
+    if x.dtype == np.float64 and y.dtype == np.float64:
+        return np.dot(x, y)
+    return np.dot(x.astype(np.float64), y.astype(np.float64))
+
+def momentum_step(x, x_prev, g, lr, momentum, work):
+    # heavy-ball update x <- x - lr*g + momentum*(x - x_prev); x_prev takes the old x
+    np.subtract(x, x_prev, out=work)
+    np.copyto(x_prev, x)
+    axpy(-lr, g, x)
+    axpy(momentum, work, x)
+    return x
+
+def adagrad_step(x, cache, g, lr, eps, work):
+    # cache += g^2; x -= lr * g / sqrt(cache + eps)
+    np.multiply(g, g, out=work)
+    cache += work
+    np.add(cache, eps, out=work)
+    np.sqrt(work, out=work)
+    np.divide(g, work, out=work)
+    axpy(-lr, work, x)
+    return x
+
+def adam_step(x, m, v, g, t, lr, beta1, beta2, eps, work):
+    # bias-corrected Adam step, with the moments m and v updated in place
+    m *= beta1
+    axpy(1 - beta1, g, m)
+    np.multiply(g, g, out=work)
+    v *= beta2
+    axpy(1 - beta2, work, v)
+    
+    np.multiply(v, 1 / (1 - beta2**t), out=work)
+    work += eps
+    np.sqrt(work, out=work)
+    np.divide(m, work, out=work)
+    axpy(-lr / (1 - beta1**t), work, x)
+    return x
+
+def project_out(g, m, mu, out):
+    # out <- g - mu * (m.g) * m
+    np.copyto(out, g)
+    axpy(-mu * np.dot(m, g), m, out)
+    return out
+
+# the powers p the compiled penalty kernels are specialized for
+LP_SQRT, LP_ABS, LP_SQUARE, LP_GENERIC = 0, 1, 2, 3
+LP_POWERS = {0.5: LP_SQRT, 1.0: LP_ABS, 2.0: LP_SQUARE}
+
+if COMPILED:
+    @njit(inline='always')
+    def _lp_power(kind, s, p):
+        # s^p and its first two derivatives p*s^(p-1) and p*(p-1)*s^(p-2)
+        if kind == LP_SQRT:
+            r = np.sqrt(s)
+            return r, 0.5 / r, -0.25 / (s * r)
+        if kind == LP_ABS:
+            return s, 1.0, 0.0
+        if kind == LP_SQUARE:
+            return s * s, 2.0 * s, 2.0
+        t = s ** (p - 1)
+        return t * s, p * t, p * (p - 1) * t / s
+    
+    @njit(inline='always')
+    def _smooth_at(x, i, epsilon):
+        # s(x_i) = |x_i| if |x_i| > epsilon else x_i^2/(2*epsilon) + epsilon/2, s' and s''
+        xi = x[i]
+        if abs(xi) > epsilon:
+            return abs(xi), 1.0 if xi > 0 else -1.0, 0.0
+        return xi * xi * (0.5 / epsilon) + 0.5 * epsilon, xi * (1.0 / epsilon), 1.0 / epsilon
+    
+    @njit(inline='always')
+    def _lp_penalty_at(kind, x, i, epsilon, p, scale, grad, with_gradient):
+        s, ds, _ = _smooth_at(x, i, epsilon)
+        s_p, d1, _ = _lp_power(kind, s, p)
+        if with_gradient:
+            grad[i] = scale * d1 * ds
+        return s_p
+    
+    @njit(inline='always')
+    def _lp_curvature_at(kind, x, i, epsilon, p, scale, out):
+        s, ds, dds = _smooth_at(x, i, epsilon)
+        _, d1, d2 = _lp_power(kind, s, p)
+        out[i] = scale * (d2 * ds * ds + d1 * dds)
+
+@lru_cache(maxsize=None)
+def _lp_kernels(kind):
+    """
+    The penalty and curvature loops for one power, serial and parallel over the
+    coordinates. kind is a constant of the closures, so numba compiles each
+    power on its own (sqrt, abs and square instead of pow) and caches it under
+    its own key
+    """
+    @njit(nogil=True, cache=True)
+    def penalty_serial(x, epsilon, p, scale, grad, with_gradient):
+        total = 0.0
+        for i in range(x.shape[0]):
+            total += _lp_penalty_at(kind, x, i, epsilon, p, scale, grad, with_gradient)
+        return scale * total
+    
+    @njit(parallel=True, cache=True)
+    def penalty_parallel(x, epsilon, p, scale, grad, with_gradient):
+        total = 0.0
+        for i in prange(x.shape[0]):
+            total += _lp_penalty_at(kind, x, i, epsilon, p, scale, grad, with_gradient)
+        return scale * total
+    
+    @njit(nogil=True, cache=True)
+    def curvature_serial(x, epsilon, p, scale, out):
+        for i in range(x.shape[0]):
+            _lp_curvature_at(kind, x, i, epsilon, p, scale, out)
+    
+    @njit(parallel=True, cache=True)
+    def curvature_parallel(x, epsilon, p, scale, out):
+        for i in prange(x.shape[0]):
+            _lp_curvature_at(kind, x, i, epsilon, p, scale, out)
+    
+    return (penalty_serial, penalty_parallel), (curvature_serial, curvature_parallel)
+
+# stands in for grad when only the penalty is wanted; never written to, but
+# numba types the argument as writable, so x (possibly read-only) cannot take its place
+_NO_GRADIENT = np.empty(0)
+
+def _lp_kernel(which, x, p):
+    kernels = _lp_kernels(LP_POWERS.get(p, LP_GENERIC))[which]
+    return kernels[x.shape[0] >= PARALLEL_MIN_SIZE]
+
+def smoothed_lp_penalty(x, epsilon, p, scale, grad=None):
+    """
+    scale * sum_i s(x_i)^p, with s the smoothed absolute value of
+    SmoothedLpL2Problem, and its gradient written into grad (if given), in a
+    single pass over x; the sum is accumulated in float64. Needs COMPILED
+        Returns:
+            penalty : float
+    """
+    with_gradient = grad is not None
+    kernel = _lp_kernel(0, x, p)
+    return kernel(x, float(epsilon), float(p), float(scale), grad if with_gradient else _NO_GRADIENT, with_gradient)
+
+def smoothed_lp_curvature(x, epsilon, p, scale, out):
+    # out <- scale * d^2/dx^2 s(x_i)^p, the diagonal Hessian of the penalty; needs COMPILED
+    _lp_kernel(1, x, p)(x, float(epsilon), float(p), float(scale), out)
+    return out
@@ -1,4 +1,5 @@
 import numpy as np
+from datasets import generate_sparse_regression, load_generated
 from problems import SmoothedLpL2Problem
 from optimizers import *
 from analyzer import ResultAnalyzer
@@ -17,30 +18,13 @@ def generate_data(m, n, sparsity=0.15, random_seed=42):
                 Random seed
         
         Returns:
-            A : ndarray (m, n)  Sparse design matrix
-            b : ndarray (m,)    Observation vector
+            A : scipy.sparse.csr_matrix (m, n)  Sparse design matrix
+            b : ndarray (m,)                    Observation vector
     """
-    rng = np.random.default_rng(random_seed)
-    
-    total_elements = m * n
-    non_zero_num = int(total_elements * sparsity)
-    flat_indices = rng.choice(total_elements, non_zero_num, replace=False)
-    rows, cols = np.unravel_index(flat_indices, (m, n))
-    A = np.zeros((m, n))
-    A[rows, cols] = rng.normal(loc=0.0, scale=1.0, size=non_zero_num)
-    
-    mask = rng.binomial(1, 0.5, size=n).astype(bool)
-    v = np.zeros(n)
-    v[~mask] = rng.normal(loc=0.0, scale=np.sqrt(1/n), size=np.sum(~mask))
-    
-    delta = rng.normal(loc=0.0, scale=1.0, size=m)
-    
-    b = A @ v + delta
-    
-    return A, b
+    return generate_sparse_regression(m, n, sparsity, random_seed)
 
 def main():
-    A, b = generate_data(1000, 1500, 0.25)
+    A, b = load_generated(1000, 1500, 0.25)
     x0 = np.zeros(A.shape[1])
     
     params = {
@@ -1,12 +1,12 @@
 import numpy as np
-from sklearn.datasets import load_svmlight_file
 from sklearn.preprocessing import StandardScaler
+from datasets import load_svmlight_cached
 from problems import LogisticRegressionL2
 from optimizers import *
 from analyzer import ResultAnalyzer
 
 def main():
-    A, b = load_svmlight_file('Data/real-sim')
+    A, b = load_svmlight_cached('Data/real-sim')
     b = (b == 1).astype(int)
     x0 = np.zeros(A.shape[1])
     
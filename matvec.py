@@ -0,0 +1,205 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+if njit is not None:
+    @njit(nogil=True, cache=True)
+    def _csr_matvec_rows(indptr, indices, data, x, out, start, stop):
+        # out[i] = A[i] @ x for start <= i < stop; runs without the GIL
+        for i in range(start, stop):
+            acc = 0.0
+            for jj in range(indptr[i], indptr[i + 1]):
+                acc += data[jj] * x[indices[jj]]
+            out[i] = acc
+
+def default_threads():
+    # honour the per-worker pinning done through OMP_NUM_THREADS (see runner.py)
+    threads = os.environ.get('OMP_NUM_THREADS')
+    return int(threads) if threads and threads.isdigit() else os.cpu_count()
+
+def _partition(indptr, parts):
+    # contiguous row ranges holding roughly the same number of nonzeros
+    targets = np.linspace(0, indptr[-1], parts + 1)
+    bounds = np.searchsorted(indptr, targets, side='left')
+    bounds[0], bounds[-1] = 0, len(indptr) - 1
+    bounds = np.unique(bounds)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+class SparseOperator:
+    """
+    Products with a CSR matrix A and with A^T, split by rows over a thread pool
+
+    A^T is kept as its own CSR matrix so that both products read memory in
+    row order. The row kernels are compiled with numba and release the GIL;
+    without numba (or with threads=1) the products fall back to scipy.
+    Products with 2-D operands (several vectors) always use scipy.
+    """
+    def __init__(self, A, threads=None):
+        self.A = sp.csr_matrix(A)
+        self.AT = self.A.T.tocsr()
+        self.shape = self.A.shape
+        self.threads = threads or default_threads()
+        self.parallel = njit is not None and self.threads > 1
+        if self.parallel:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads)
+            self._rows = _partition(self.A.indptr, self.threads)
+            self._cols = _partition(self.AT.indptr, self.threads)
+            self._warm_up()
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_pool', None)
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.parallel:
+            self._pool = ThreadPoolExecutor(max_workers=self.threads)
+            self._warm_up()
+    
+    def _warm_up(self):
+        # numba compiles (or loads from its cache) the row kernel on its first
+        # call; make that call here, on empty row ranges, rather than in the
+        # first timed product
+        for M, n_in, n_out in ((self.A, self.shape[1], self.shape[0]), (self.AT, self.shape[0], self.shape[1])):
+            self._run(M, [(0, 0)], np.zeros(n_in, dtype=M.dtype), np.empty(n_out, dtype=M.dtype))
+    
+    def _run(self, M, ranges, v, out):
+        args = (M.indptr, M.indices, M.data, v, out)
+        futures = [self._pool.submit(_csr_matvec_rows, *args, start, stop) for start, stop in ranges]
+        for future in futures:
+            future.result()
+        return out
+    
+    def matvec(self, x, out=None):
+        # operands are cast to the dtype of A, which the product is carried out in
+        x = x.astype(self.A.dtype, copy=False)
+        if not self.parallel or x.ndim != 1:
+            return self.A @ x
+        out = np.empty(self.shape[0], dtype=np.result_type(self.A.dtype, x.dtype)) if out is None else out
+        return self._run(self.A, self._rows, x, out)
+    
+    def rmatvec(self, r, out=None):
+        r = r.astype(self.A.dtype, copy=False)
+        if not self.parallel or r.ndim != 1:
+            return self.AT @ r
+        out = np.empty(self.shape[1], dtype=np.result_type(self.A.dtype, r.dtype)) if out is None else out
+        return self._run(self.AT, self._cols, r, out)
+    
+    def fused(self, x, f):
+        """
+        z = A @ x and y = A^T @ f(z) in one call, as two sweeps over A (the
+        second over A^T); f may return a workspace array, it is consumed
+        before fused returns
+            Returns:
+                z : ndarray (m,)
+                y : ndarray (n,)
+        """
+        z = self.matvec(x)
+        return z, self.rmatvec(f(z))
+    
+    def __matmul__(self, v):
+        return self.matvec(v)
+    
+    @property
+    def T(self):
+        return _Transposed(self)
+
+class _Transposed:
+    def __init__(self, operator):
+        self.operator = operator
+    
+    def __matmul__(self, r):
+        return self.operator.rmatvec(r)
+
+class ChunkedOperator:
+    """
+    Products with a CSR matrix A that need not fit in memory (e.g. memory-mapped
+    by datasets.load_arrays), streamed over blocks of rows
+
+    Each block holds about chunk_bytes of A. A background thread copies the next
+    block from A into one of two buffers while the caller works on the current
+    one, so reading A overlaps with compute. Only the row pointers, the two
+    buffers and vectors of length m and n are held in memory. With dtype
+    given, the blocks are cast to it as they are copied, and the products are
+    carried out in it; A itself is left as it is.
+    """
+    def __init__(self, A, chunk_bytes=64 << 20, dtype=None):
+        self.A = A
+        self.shape = A.shape
+        self.chunk_bytes = chunk_bytes
+        self.dtype = np.dtype(dtype or A.data.dtype)
+        self._indptr = np.array(A.indptr)
+        per_block = max(1, chunk_bytes // (self.dtype.itemsize + A.indices.itemsize))
+        targets = np.arange(per_block, self._indptr[-1], per_block)
+        bounds = np.searchsorted(self._indptr, targets, side='left')
+        self._bounds = np.unique(np.concatenate(([0], bounds, [self.shape[0]])))
+        self._block_nnz = int(np.diff(self._indptr[self._bounds]).max(initial=0))
+        self._io = None
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_io'] = None
+        state.pop('_buffers', None)
+        return state
+    
+    def _load(self, slot, start, stop):
+        lo, hi = self._indptr[start], self._indptr[stop]
+        data, indices = self._buffers[slot]
+        data, indices = data[:hi - lo], indices[:hi - lo]
+        np.copyto(data, self.A.data[lo:hi])
+        np.copyto(indices, self.A.indices[lo:hi])
+        return sp.csr_matrix((data, indices, self._indptr[start:stop + 1] - lo),
+                             shape=(stop - start, self.shape[1]), copy=False)
+    
+    def blocks(self):
+        """
+        (start, stop, block) for consecutive row ranges of A, block being
+        A[start:stop] as a CSR matrix. The block is only valid until the next
+        one is requested, as its buffer is then reused
+        """
+        if self._io is None:
+            self._io = ThreadPoolExecutor(max_workers=1)
+            self._buffers = [(np.empty(self._block_nnz, dtype=self.dtype),
+                              np.empty(self._block_nnz, dtype=self.A.indices.dtype)) for _ in range(2)]
+        bounds = self._bounds
+        pending = self._io.submit(self._load, 0, bounds[0], bounds[1])
+        for i in range(len(bounds) - 1):
+            block = pending.result()
+            if i + 2 < len(bounds):
+                pending = self._io.submit(self._load, (i + 1) % 2, bounds[i + 1], bounds[i + 2])
+            yield bounds[i], bounds[i + 1], block
+    
+    def matvec(self, x):
+        x = x.astype(self.dtype, copy=False)
+        out = np.empty((self.shape[0],) + x.shape[1:], dtype=self.dtype)
+        for start, stop, block in self.blocks():
+            out[start:stop] = block @ x
+        return out
+    
+    def rmatvec(self, r):
+        r = r.astype(self.dtype, copy=False)
+        # the blocks' contributions are summed in float64
+        out = np.zeros((self.shape[1],) + r.shape[1:])
+        for start, stop, block in self.blocks():
+            out += block.T @ r[start:stop]
+        return out
+    
+    def fused(self, x, f):
+        # f needs all of z, hence two passes; see ChunkedLogisticRegressionL2
+        # for a one-pass gradient
+        z = self.matvec(x)
+        return z, self.rmatvec(f(z))
+    
+    def __matmul__(self, v):
+        return self.matvec(v)
+    
+    @property
+    def T(self):
+        return _Transposed(self)
@@ -0,0 +1,68 @@
+import numpy as np
+
+class Monitor:
+    """
+    Decides what an optimizer records and when it stops early
+        Parameters:
+            log_every : int (default=1)
+                Record every log_every-th iteration; 0 records nothing but the final values
+            log_loss : bool (default=True)
+                Also record the loss. Without it, only gradients are evaluated
+                unless a stopping rule needs the loss
+            f_star, target_gap : float (default=None)
+                Stop once loss - f_star <= target_gap
+            time_budget : float (default=None)
+                Stop after this many seconds of wall time
+            stall_iters, stall_tol : int, float (default=None, 1e-3)
+                Stop when the best gradient norm has not dropped by a relative
+                stall_tol within the last stall_iters iterations
+            callbacks : list of callables (default=())
+                Called as callback(k, x, info) after every iteration, where
+                info holds 'loss' (None if not evaluated), 'grad_norm' and
+                'elapsed'. Returning True stops the run
+    """
+    def __init__(self, log_every=1, log_loss=True, f_star=None, target_gap=None, time_budget=None,
+                 stall_iters=None, stall_tol=1e-3, callbacks=()):
+        self.log_every = log_every
+        self.log_loss = log_loss
+        self.f_star = f_star
+        self.target_gap = target_gap
+        self.time_budget = time_budget
+        self.stall_iters = stall_iters
+        self.stall_tol = stall_tol
+        self.callbacks = list(callbacks)
+        self.reset()
+    
+    def reset(self):
+        self._best_grad_norm = np.inf
+        self._best_iter = 0
+    
+    def state_dict(self):
+        return {'best_grad_norm': float(self._best_grad_norm), 'best_iter': int(self._best_iter)}
+    
+    def load_state_dict(self, state):
+        self._best_grad_norm = state['best_grad_norm']
+        self._best_iter = state['best_iter']
+    
+    def logs(self, k):
+        return self.log_every > 0 and k % self.log_every == 0
+    
+    def wants_loss(self, k):
+        return (self.log_loss and self.logs(k)) or self.target_gap is not None
+    
+    def should_stop(self, k, x, loss, grad_norm, elapsed):
+        # returns the reason for stopping, or None
+        if self.target_gap is not None and loss is not None and loss - self.f_star <= self.target_gap:
+            return 'target_gap'
+        if self.time_budget is not None and elapsed >= self.time_budget:
+            return 'time_budget'
+        if self.stall_iters is not None:
+            if grad_norm < (1 - self.stall_tol) * self._best_grad_norm:
+                self._best_grad_norm, self._best_iter = grad_norm, k
+            elif k - self._best_iter >= self.stall_iters:
+                return 'stall'
+        info = {'loss': loss, 'grad_norm': grad_norm, 'elapsed': elapsed}
+        for callback in self.callbacks:
+            if callback(k, x, info):
+                return 'callback'
+        return None
@@ -1,10 +1,187 @@
+import hashlib
+import os
 import numpy as np
-import time
 from abc import ABC, abstractmethod
+from checkpoints import load_checkpoint, save_checkpoint
+from instrumentation import Instrumentation
+from kernels import adagrad_step, adam_step, axpy, dot64, momentum_step, project_out
+from monitors import Monitor
+from oracles import CachedProblem, InstrumentedProblem
+
+def hessian_vector_product(problem, x, g, v, eps):
+    # exact product when the problem provides one, otherwise a finite difference of gradients
+    if getattr(problem, 'has_hvp', False):
+        return problem.hessian_vector_product(x, v)
+    return (g - problem.gradient(x - eps * v)) / eps
 
 class Optimizer(ABC):
     def __init__(self, **params):
         self.params = params
+        self.params.setdefault('record_trajectory', False)
+        self.params.setdefault('trajectory_stride', 1)
+        self.params.setdefault('trajectory_dtype', None)
+        self.params.setdefault('record_times', True)
+        self.params.setdefault('checkpoint', None)
+        self.params.setdefault('checkpoint_every', 100)
+        self.final_state = {}
+        self._warm = {}
+    
+    def warm_start(self, state=None):
+        """
+        Start the following runs from state, typically carried_state() of a run
+        on a nearby problem, instead of from the initial params (e.g. AIM's beta
+        and mu, Adam's moments). None goes back to cold starts
+        """
+        self._warm = dict(state or {})
+        return self
+    
+    def carried_state(self):
+        # a copy of the adaptive state the last run ended with
+        return {name: value.copy() if isinstance(value, np.ndarray) else value
+                for name, value in self.final_state.items()}
+    
+    def _warm_value(self, name, default):
+        value = self._warm.get(name, default)
+        return value.copy() if isinstance(value, np.ndarray) else value
+    
+    def _start(self, problem, monitor=None):
+        # the problem is wrapped before any caching layer, so the counts
+        # reflect evaluations that were actually performed
+        self.instrumentation = Instrumentation().start()
+        self.monitor = monitor if monitor is not None else Monitor()
+        self.monitor.reset()
+        history = {'iters': [], 'losses': [], 'grad_norms': [], 'n_iter': 0}
+        if self.params['record_times']:
+            history['times'] = []
+        self._problem = InstrumentedProblem(problem, self.instrumentation)
+        return self._problem, history
+    
+    def _finish(self, history, **state):
+        # state is what a warm start of a later run may carry over (see warm_start)
+        self.final_state = state
+        run_time = self.instrumentation.stop()
+        history['stats'] = self.instrumentation.summary()
+        return run_time
+    
+    def _phase(self, name):
+        return self.instrumentation.phase(name)
+    
+    def _evaluate(self, problem, x, history):
+        # the loss is only evaluated when it is recorded, a stopping rule needs it
+        # or the iteration is the last one, whose values are always recorded
+        k = history['n_iter'] + 1
+        if self.monitor.wants_loss(k) or k >= self.params['max_iter']:
+            return problem.loss_and_gradient(x)
+        return None, problem.gradient(x)
+    
+    def _log(self, history, x, loss, grad):
+        # counts one iteration, records it if the monitor asks for it (and
+        # always when stopping), and returns True when the run should stop
+        with self._phase('bookkeeping'):
+            k = history['n_iter'] = history['n_iter'] + 1
+            grad_norm = np.linalg.norm(grad)
+            elapsed = self.instrumentation.elapsed()
+            if grad_norm < self.params['gtol']:
+                reason = 'gtol'
+            else:
+                reason = self.monitor.should_stop(k, x, loss, grad_norm, elapsed)
+            if reason is None and k >= self.params['max_iter']:
+                reason = 'max_iter'
+            if reason is not None and loss is None:
+                # the final values are always recorded; A @ x is still cached
+                loss = self._problem.loss(x)
+            
+            if self.monitor.logs(k) or reason is not None:
+                history['iters'].append(k)
+                history['losses'].append(np.nan if loss is None else loss)
+                history['grad_norms'].append(grad_norm)
+                if 'times' in history:
+                    history['times'].append(elapsed)
+            history['final_grad_norm'] = grad_norm
+            if loss is not None:
+                history['final_loss'] = loss
+            if reason is not None:
+                history['stop_reason'] = reason
+        return reason is not None
+    
+    def _record_trajectory(self, history, k, x):
+        # iterates are only kept on request, every trajectory_stride-th one,
+        # optionally down-cast (e.g. to np.float32) to save memory
+        if not self.params['record_trajectory'] or k % self.params['trajectory_stride']:
+            return
+        with self._phase('bookkeeping'):
+            dtype = self.params['trajectory_dtype'] or x.dtype
+            history.setdefault('trajectories', []).append(x.astype(dtype, copy=True))
+    
+    def _run_key(self, problem, x0):
+        # identifies a run, so that a checkpoint is only resumed by the run that wrote it
+        h = hashlib.sha1(type(self).__name__.encode())
+        h.update(problem.cache_key().encode())
+        h.update(np.ascontiguousarray(x0, dtype=np.float64).tobytes())
+        params = sorted((name, value) for name, value in self.params.items() if not name.startswith('checkpoint'))
+        h.update(repr(params).encode())
+        for name, value in sorted(self._warm.items()):
+            h.update(name.encode())
+            h.update(np.ascontiguousarray(value, dtype=np.float64).tobytes())
+        return h.hexdigest()
+    
+    def _restore(self, problem, x0, history):
+        """
+        With params['checkpoint'] set and its file present, loads the checkpoint
+        into history, the monitor and the instrumentation, and returns the
+        optimizer's own state, including the iteration 'k' it was taken after.
+        Returns None when the run starts from x0
+        """
+        path = self.params['checkpoint']
+        if path is None:
+            return None
+        self._run = self._run_key(problem, x0)
+        if not os.path.exists(path):
+            return None
+        meta, arrays = load_checkpoint(path)
+        if meta['run'] != self._run:
+            raise ValueError(f"checkpoint {path} was written by a different run "
+                             f"(optimizer, problem, x0 or parameters differ)")
+        
+        history.update(meta['history'])
+        for name, value in arrays.items():
+            if name == 'history/trajectories':
+                history['trajectories'] = list(value)
+            elif name.startswith('history/'):
+                history[name[len('history/'):]] = value.tolist()
+        state = dict(meta['state'])
+        state.update({name[len('state/'):]: value[()] if value.ndim == 0 else value
+                      for name, value in arrays.items() if name.startswith('state/')})
+        self.monitor.load_state_dict(meta['monitor'])
+        self.instrumentation.load_state_dict(meta['instrumentation'])
+        return state
+    
+    def _checkpoint(self, history, k, **state):
+        # every checkpoint_every-th iteration, writes the given state (arrays and
+        # scalars) together with the history, monitor and instrumentation
+        path = self.params['checkpoint']
+        if path is None or k % self.params['checkpoint_every']:
+            return
+        with self._phase('bookkeeping'):
+            arrays, history_meta = {}, {}
+            for name, value in history.items():
+                if name == 'trajectories':
+                    arrays['history/trajectories'] = np.stack(value)
+                elif isinstance(value, list):
+                    arrays['history/' + name] = np.asarray(value)
+                else:
+                    history_meta[name] = value
+            scalars = {'k': k}
+            for name, value in state.items():
+                # numpy scalars go with the arrays, so that they come back in their own dtype
+                if isinstance(value, (np.ndarray, np.generic)):
+                    arrays['state/' + name] = np.asarray(value)
+                else:
+                    scalars[name] = value
+            meta = {'run': self._run, 'optimizer': type(self).__name__, 'state': scalars,
+                    'history': history_meta, 'monitor': self.monitor.state_dict(),
+                    'instrumentation': self.instrumentation.state_dict()}
+            save_checkpoint(path, meta, arrays)
     
     @abstractmethod
     def optimize(self, problem, initial_w, **params): pass
@@ -16,28 +193,32 @@ class GradientDescent(Optimizer):
         self.params.setdefault('max_iter', 10000)
         self.params.setdefault('gtol', 1e-6)
     
-    def optimize(self, problem, x0):
-        t_start = time.process_time()
-        
-        x = x0.copy()
-        history = {'losses': [], 'grad_norms': []}
-        grad = problem.gradient(x)
+    def optimize(self, problem, x0, monitor=None):
+        problem, history = self._start(problem, monitor)
         
-        for _ in range(self.params['max_iter']):
-            x -= self.params['lr'] * grad
+        state = self._restore(problem, x0, history)
+        if state is None:
+            x = x0.copy()
+            self._record_trajectory(history, 0, x)
             grad = problem.gradient(x)
+            start = 1
+        else:
+            x, grad, start = state['x'], state['grad'], state['k'] + 1
+        
+        for k in range(start, self.params['max_iter']+1):
+            with self._phase('update'):
+                axpy(-self.params['lr'], grad, x)
+            self._record_trajectory(history, k, x)
+            loss, grad = self._evaluate(problem, x, history)
             
-            history['losses'].append(problem.loss(x))
-            history['grad_norms'].append(np.linalg.norm(grad))
-            
-            if history['grad_norms'][-1] < self.params['gtol']:
+            if self._log(history, x, loss, grad):
                 break
+            self._checkpoint(history, k, x=x, grad=grad)
         
-        t_end = time.process_time()
-        run_time = t_end - t_start
+        run_time = self._finish(history)
         
         return x, run_time, history
-    
+
 class HeavyBall(Optimizer):
     def __init__(self, **params):
         super().__init__(**params)
@@ -45,32 +226,37 @@ class HeavyBall(Optimizer):
         self.params.setdefault('momentum', 0.9)
         self.params.setdefault('max_iter', 10000)
         self.params.setdefault('gtol', 1e-6)
-        
-    def optimize(self, problem, x0):
-        t_start = time.process_time()
-        
-        x = x0.copy()
-        history = {'trajectories': [], 'losses': [], 'grad_norms': []}
-        history['trajectories'].append(x.copy())
-        g = problem.gradient(x)
-        x -= self.params['lr'] * g
-        history['trajectories'].append(x.copy())
-        
-        for _ in range(self.params['max_iter']):
+    
+    def optimize(self, problem, x0, monitor=None):
+        problem, history = self._start(problem, monitor)
+        
+        state = self._restore(problem, x0, history)
+        if state is None:
+            x = x0.copy()
+            x_prev = x.copy()
+            self._record_trajectory(history, 0, x)
             g = problem.gradient(x)
-            history['losses'].append(problem.loss(x))
-            history['grad_norms'].append(np.linalg.norm(g))
-            if history['grad_norms'][-1] < self.params['gtol']:
+            axpy(-self.params['lr'], g, x)
+            self._record_trajectory(history, 1, x)
+            start = 2
+        else:
+            x, x_prev, start = state['x'], state['x_prev'], state['k'] + 1
+        d = np.empty_like(x)
+        
+        for k in range(start, self.params['max_iter']+2):
+            loss, g = self._evaluate(problem, x, history)
+            if self._log(history, x, loss, g):
                 break
             
-            x = x - self.params['lr'] * g + self.params['momentum'] * (x - history['trajectories'][-2])
-            history['trajectories'].append(x.copy())
+            with self._phase('update'):
+                momentum_step(x, x_prev, g, self.params['lr'], self.params['momentum'], d)
+            self._record_trajectory(history, k, x)
+            self._checkpoint(history, k, x=x, x_prev=x_prev)
         
-        t_end = time.process_time()
-        run_time = t_end - t_start
+        run_time = self._finish(history)
         
         return x, run_time, history
-    
+
 class NesterovAcceleratedGradientWithLineSearch(Optimizer):
     def __init__(self, **params):
         super().__init__(**params)
@@ -78,50 +264,69 @@ class NesterovAcceleratedGradientWithLineSearch(Optimizer):
         self.params.setdefault('beta', 0.9)
         self.params.setdefault('max_iter', 10000)
         self.params.setdefault('gtol', 1e-6)
-        
-    def optimize(self, problem, x0):
-        t_start = time.process_time()
-        
-        x_k = x0.copy()
-        v_k = x0.copy()
-        theta_k = 1.0
-        t_k = self.params['lr']
-        history = {'losses': [], 'grad_norms': []}
-        
-        for k in range(1, self.params['max_iter'] + 1):
-            y_k = (1 - theta_k) * x_k + theta_k * v_k
+    
+    def optimize(self, problem, x0, monitor=None):
+        problem, history = self._start(problem, monitor)
+        
+        problem = CachedProblem.wrap(problem)
+        state = self._restore(problem, x0, history)
+        if state is None:
+            x_k = x0.copy()
+            v_k = x0.copy()
+            theta_k = 1.0
+            t_k = self.params['lr']
+            self._record_trajectory(history, 0, x_k)
+            start = 1
+        else:
+            x_k, v_k, theta_k, t_k = state['x_k'], state['v_k'], state['theta_k'], state['t_k']
+            problem.hits, problem.misses = state['cache_hits'], state['cache_misses']
+            start = state['k'] + 1
+        y_k = np.empty_like(x_k)
+        x_k_next = np.empty_like(x_k)
+        
+        for k in range(start, self.params['max_iter'] + 1):
+            with self._phase('direction'):
+                np.multiply(x_k, 1 - theta_k, out=y_k)
+                axpy(theta_k, v_k, y_k)
             
+            loss_x_k, grad_x_k = self._evaluate(problem, x_k, history)
             grad_y_k = problem.gradient(y_k)
-            grad_x_k = problem.gradient(x_k)
             
-            history['losses'].append(problem.loss(x_k))
-            grad_norm = np.linalg.norm(grad_x_k)
-            history['grad_norms'].append(grad_norm)
-            if grad_norm < self.params['gtol']:
+            if self._log(history, x_k, loss_x_k, grad_x_k):
                 break
             
             # backtracking line search
-            t_k_next = self.params['lr']
-            while True:
-                x_k_next = y_k - t_k_next * grad_y_k
-                if problem.loss(x_k_next) <= problem.loss(y_k) - (t_k_next / 2) * np.linalg.norm(grad_y_k) ** 2:
-                    break
-                t_k_next *= self.params['beta']
-                
-            ratio = (t_k_next / t_k) * theta_k ** 2
-            theta_k_next = (-np.sqrt(ratio) + np.sqrt(4 + ratio)) / 2
-            
-            v_k = x_k + (1 / theta_k_next) * (x_k_next - x_k)
+            with self._phase('line_search'):
+                t_k_next = self.params['lr']
+                while True:
+                    np.copyto(x_k_next, y_k)
+                    axpy(-t_k_next, grad_y_k, x_k_next)
+                    # Armijo test in float64, the losses are float64 at any precision
+                    decrease = (t_k_next / 2) * np.linalg.norm(grad_y_k.astype(np.float64, copy=False)) ** 2
+                    if problem.loss(x_k_next) <= problem.loss(y_k) - decrease:
+                        break
+                    t_k_next *= self.params['beta']
             
-            x_k = x_k_next
+            with self._phase('update'):
+                ratio = (t_k_next / t_k) * theta_k ** 2
+                theta_k_next = (-np.sqrt(ratio) + np.sqrt(4 + ratio)) / 2
+                
+                np.subtract(x_k_next, x_k, out=v_k)
+                v_k *= 1 / theta_k_next
+                v_k += x_k
+                
+                x_k, x_k_next = x_k_next, x_k
+            self._record_trajectory(history, k, x_k)
             theta_k = theta_k_next
             t_k = t_k_next
-            
-        t_end = time.process_time()
-        run_time = t_end - t_start
-            
+            self._checkpoint(history, k, x_k=x_k, v_k=v_k, theta_k=theta_k, t_k=t_k,
+                             cache_hits=problem.hits, cache_misses=problem.misses)
+        
+        history['oracle_cache'] = {'hits': problem.hits, 'misses': problem.misses}
+        run_time = self._finish(history)
+        
         return x_k, run_time, history
-    
+
 class Adagrad(Optimizer):
     def __init__(self, **params):
         super().__init__(**params)
@@ -129,31 +334,35 @@ class Adagrad(Optimizer):
         self.params.setdefault('eps', 1e-8)
         self.params.setdefault('max_iter', 10000)
         self.params.setdefault('gtol', 1e-6)
-        
-    def optimize(self, problem, x0):
-        t_start = time.process_time()
-        
-        x = x0.copy()
-        cache = np.zeros_like(x)
-        history = {'losses': [], 'grad_norms': []}
-        grad = problem.gradient(x)
-        
-        for _ in range(self.params['max_iter']):
-            cache += grad**2
-            x -= self.params['lr'] * grad / np.sqrt(cache + self.params['eps'])
+    
+    def optimize(self, problem, x0, monitor=None):
+        problem, history = self._start(problem, monitor)
+        
+        state = self._restore(problem, x0, history)
+        if state is None:
+            x = x0.copy()
+            cache = self._warm_value('cache', np.zeros_like(x))
+            self._record_trajectory(history, 0, x)
             grad = problem.gradient(x)
+            start = 1
+        else:
+            x, cache, grad, start = state['x'], state['cache'], state['grad'], state['k'] + 1
+        work = np.empty_like(x)
+        
+        for k in range(start, self.params['max_iter']+1):
+            with self._phase('update'):
+                adagrad_step(x, cache, grad, self.params['lr'], self.params['eps'], work)
+            self._record_trajectory(history, k, x)
+            loss, grad = self._evaluate(problem, x, history)
             
-            history['losses'].append(problem.loss(x))
-            history['grad_norms'].append(np.linalg.norm(grad))
-            
-            if history['grad_norms'][-1] < self.params['gtol']:
+            if self._log(history, x, loss, grad):
                 break
+            self._checkpoint(history, k, x=x, cache=cache, grad=grad)
         
-        t_end = time.process_time()
-        run_time = t_end - t_start
+        run_time = self._finish(history, cache=cache)
         
         return x, run_time, history
-    
+
 class Adam(Optimizer):
     def __init__(self, **params):
         super().__init__(**params)
@@ -163,78 +372,98 @@ class Adam(Optimizer):
         self.params.setdefault('eps', 1e-8)
         self.params.setdefault('max_iter', 10000)
         self.params.setdefault('gtol', 1e-6)
-        
-    def optimize(self, problem, x0):
-        t_start = time.process_time()
-        
-        x = x0.copy()
-        m = np.zeros_like(x)
-        v = np.zeros_like(x)
-        history = {'losses': [], 'grad_norms': []}
-        grad = problem.gradient(x)
-        
-        for t in range(1, self.params['max_iter']+1):
-            m = self.params['beta1']*m + (1-self.params['beta1'])*grad
-            v = self.params['beta2']*v + (1-self.params['beta2'])*grad**2
-            
-            m_hat = m / (1 - self.params['beta1']**t)
-            v_hat = v / (1 - self.params['beta2']**t)
-            
-            x -= self.params['lr'] * m_hat / np.sqrt(v_hat + self.params['eps'])
+    
+    def optimize(self, problem, x0, monitor=None):
+        problem, history = self._start(problem, monitor)
+        
+        state = self._restore(problem, x0, history)
+        if state is None:
+            x = x0.copy()
+            m = self._warm_value('m', np.zeros_like(x))
+            v = self._warm_value('v', np.zeros_like(x))
+            self._record_trajectory(history, 0, x)
             grad = problem.gradient(x)
+            start = 1
+        else:
+            x, m, v, grad, start = state['x'], state['m'], state['v'], state['grad'], state['k'] + 1
+        # bias correction continues from the steps a warm start carries over
+        steps = self._warm_value('steps', 0)
+        t = start - 1
+        work = np.empty_like(x)
+        
+        for t in range(start, self.params['max_iter']+1):
+            with self._phase('update'):
+                adam_step(x, m, v, grad, steps + t, self.params['lr'], self.params['beta1'],
+                          self.params['beta2'], self.params['eps'], work)
+            self._record_trajectory(history, t, x)
+            loss, grad = self._evaluate(problem, x, history)
             
-            history['losses'].append(problem.loss(x))
-            history['grad_norms'].append(np.linalg.norm(grad))
-            
-            if history['grad_norms'][-1] < self.params['gtol']:
+            if self._log(history, x, loss, grad):
                 break
+            self._checkpoint(history, t, x=x, m=m, v=v, grad=grad)
         
-        t_end = time.process_time()
-        run_time = t_end - t_start
+        run_time = self._finish(history, m=m, v=v, steps=steps + t)
         
         return x, run_time, history
-    
+
 class DRSOM(Optimizer):
     def __init__(self, **params):
         super().__init__(**params)
         self.params.setdefault('initial_lr', 1e-4)
         self.params.setdefault('eps', 1.0)
+        self.params.setdefault('exact_hvp', True)
         self.params.setdefault('max_iter', 10000)
         self.params.setdefault('gtol', 1e-6)
-        
-    def optimize(self, problem, x0):
-        t_start = time.process_time()
-        
-        x = x0.copy()
+    
+    def optimize(self, problem, x0, monitor=None):
+        problem, history = self._start(problem, monitor)
+        
+        problem = CachedProblem.wrap(problem)
+        state = self._restore(problem, x0, history)
+        if state is None:
+            x = x0.copy()
+            x_prev = x.copy()
+            self._record_trajectory(history, 0, x)
+            g = problem.gradient(x)
+            axpy(-self.params['initial_lr'], g, x)
+            self._record_trajectory(history, 1, x)
+            start = 2
+        else:
+            x, x_prev, g = state['x'], state['x_prev'], state['g']
+            problem.hits, problem.misses = state['cache_hits'], state['cache_misses']
+            start = state['k'] + 1
+        d = np.empty_like(x)
+        Hd = np.empty_like(x)
         eps = self.params['eps']
-        history = {'trajectories': [], 'losses': [], 'grad_norms': []}
         
-        history['trajectories'].append(x.copy())
-        g = problem.gradient(x)
-        x -= self.params['initial_lr'] * g
-        history['trajectories'].append(x.copy())
-        
-        for _ in range(self.params['max_iter']):
-            g_pre = g.copy()
-            g = problem.gradient(x)
-            history['losses'].append(problem.loss(x))
-            history['grad_norms'].append(np.linalg.norm(g))
-            if history['grad_norms'][-1] < self.params['gtol']:
+        for k in range(start, self.params['max_iter']+2):
+            g_pre = g
+            loss, g = self._evaluate(problem, x, history)
+            if self._log(history, x, loss, g):
                 break
             
-            Hg = (g - problem.gradient(x - eps * g)) / eps
-            d = x - history['trajectories'][-2]
-            Hd = g - g_pre
-            
-            Q = np.array([[np.inner(g, Hg), -np.inner(d, Hg)], [-np.inner(d, Hg), np.inner(d, Hd)]])
-            c = np.array([np.inner(g, g), -np.inner(g, d)])
-            alpha = np.linalg.inv(Q) @ c
-            
-            x = x - alpha[0] * g + alpha[1] * d
-            history['trajectories'].append(x.copy())
+            with self._phase('direction'):
+                if self.params['exact_hvp']:
+                    Hg = hessian_vector_product(problem, x, g, g, eps)
+                else:
+                    Hg = (g - problem.gradient(x - eps * g)) / eps
+                np.subtract(x, x_prev, out=d)
+                np.subtract(g, g_pre, out=Hd)
+                
+                Q = np.array([[np.inner(g, Hg), -np.inner(d, Hg)], [-np.inner(d, Hg), np.inner(d, Hd)]])
+                c = np.array([np.inner(g, g), -np.inner(g, d)])
+                alpha = np.linalg.inv(Q) @ c
             
-        t_end = time.process_time()
-        run_time = t_end - t_start
+            with self._phase('update'):
+                np.copyto(x_prev, x)
+                axpy(-alpha[0], g, x)
+                axpy(alpha[1], d, x)
+            self._record_trajectory(history, k, x)
+            self._checkpoint(history, k, x=x, x_prev=x_prev, g=g,
+                             cache_hits=problem.hits, cache_misses=problem.misses)
+        
+        history['oracle_cache'] = {'hits': problem.hits, 'misses': problem.misses}
+        run_time = self._finish(history)
         
         return x, run_time, history
 
@@ -247,73 +476,215 @@ class AIM(Optimizer):
         self.params.setdefault('eta', 0.9)
         self.params.setdefault('mu', 0.75)
         self.params.setdefault('eps', 1e-3)
+        self.params.setdefault('exact_hvp', True)
         self.params.setdefault('max_iter', 10000)
         self.params.setdefault('mtol', 1e-8)
         self.params.setdefault('gtol', 1e-6)
-        
-    def optimize(self, problem, x0):
-        t_start = time.process_time()
-        
-        x = x0.copy()
+    
+    def optimize(self, problem, x0, monitor=None):
+        problem, history = self._start(problem, monitor)
+        
+        problem = CachedProblem.wrap(problem)
+        state = self._restore(problem, x0, history)
+        if state is None:
+            x = x0.copy()
+            self._record_trajectory(history, 0, x)
+            g = problem.gradient(x)
+            axpy(-self.params['initial_lr'], g, x)
+            self._record_trajectory(history, 1, x)
+            beta = self._warm_value('beta', self.params['beta'])
+            mu = self._warm_value('mu', self.params['mu'])
+            start = 2
+        else:
+            x, g, beta, mu = state['x'], state['g'], state['beta'], state['mu']
+            problem.hits, problem.misses = state['cache_hits'], state['cache_misses']
+            start = state['k'] + 1
+        # the 'v' and 'QN' directions are measured from the starting point
+        x_ref = np.array(x0, dtype=x.dtype)
         m = np.zeros_like(x)
-        x_nxt = np.zeros_like(x)
-        g_nxt = np.zeros_like(x)
-        history = {'trajectories': [], 'losses': [], 'grad_norms': []}
-        
-        history['trajectories'].append(x.copy())
-        g = problem.gradient(x)
-        x -= self.params['initial_lr'] * g
-        history['trajectories'].append(x.copy())
-        
-        beta = self.params['beta']
-        mu = self.params['mu']
+        s = np.empty_like(x)
+        y = np.empty_like(x)
+        direction = np.empty_like(x)
+        x_nxt = np.empty_like(x)
+        dx = np.empty_like(x)
+        dg = np.empty_like(x)
         eps = self.params['eps']
         eta = self.params['eta']
         
-        for _ in range(self.params['max_iter']):
-            g_pre = g.copy()
-            g = problem.gradient(x)
-            history['losses'].append(problem.loss(x))
-            history['grad_norms'].append(np.linalg.norm(g))
-            if history['grad_norms'][-1] < self.params['gtol']:
+        for k in range(start, self.params['max_iter']+2):
+            g_pre = g
+            loss, g = self._evaluate(problem, x, history)
+            if self._log(history, x, loss, g):
                 break
             
-            if self.params['mtype'] == 'v':
-                m = x - history['trajectories'][-2]
-            elif self.params['mtype'] == 'a':
-                m = g - g_pre
-            elif self.params['mtype'] == 'QN':
-                s = x - history['trajectories'][-2]
-                y = g - g_pre
-                alpha = max(np.inner(s, s) / abs(np.inner(s, y)), beta / eta) * 1.1
-                m = alpha * y - s
-                mu = np.inner(m, m) / np.inner(m, alpha * y)
-            elif self.params['mtype'] == 'Hg':
-                m = (g - problem.gradient(x - eps * g)) / eps
-            norm_m = np.linalg.norm(m)
-            m = m / norm_m if norm_m > self.params['mtol'] else np.zeros_like(x)
-            
-            while True:
-                x_nxt = x - beta * (g - mu * np.dot(m, g) * m)
-                g_nxt = problem.gradient(x_nxt)
-                
-                dx = x - x_nxt
-                dg = g - g_nxt
-                
-                r_u = np.dot(dx, dg) * beta
-                r_d = np.dot(dx, dx) + mu / (1 - mu) * np.dot(m, dx)**2
-                
-                r = r_u / r_d
-                if r > eta:
-                    beta = beta * min(1.0, 1.0 / r) / 1.5
+            with self._phase('direction'):
+                if self.params['mtype'] == 'v':
+                    np.subtract(x, x_ref, out=m)
+                elif self.params['mtype'] == 'a':
+                    np.subtract(g, g_pre, out=m)
+                elif self.params['mtype'] == 'QN':
+                    np.subtract(x, x_ref, out=s)
+                    np.subtract(g, g_pre, out=y)
+                    alpha = max(np.inner(s, s) / abs(np.inner(s, y)), beta / eta) * 1.1
+                    y *= alpha
+                    np.subtract(y, s, out=m)
+                    mu = np.inner(m, m) / np.inner(m, y)
+                elif self.params['mtype'] == 'Hg':
+                    if self.params['exact_hvp']:
+                        m = hessian_vector_product(problem, x, g, g, eps)
+                    else:
+                        m = (g - problem.gradient(x - eps * g)) / eps
+                norm_m = np.linalg.norm(m)
+                if norm_m > self.params['mtol']:
+                    m /= norm_m
                 else:
-                    if r < 0.5:
-                        beta = 2.0 * beta / (max(r, 0) + 1e-3)
-                    break
+                    m.fill(0.0)
                 
-            x = x_nxt.copy()
+                project_out(g, m, mu, direction)
+            
+            with self._phase('line_search'):
+                while True:
+                    np.copyto(x_nxt, x)
+                    axpy(-beta, direction, x_nxt)
+                    g_nxt = problem.gradient(x_nxt)
+                    
+                    np.subtract(x, x_nxt, out=dx)
+                    np.subtract(g, g_nxt, out=dg)
+                    
+                    # the ratio test is carried out in float64 whatever the precision of the iterates
+                    r_u = dot64(dx, dg) * beta
+                    r_d = dot64(dx, dx) + mu / (1 - mu) * dot64(m, dx)**2
+                    
+                    r = r_u / r_d
+                    if r > eta:
+                        beta = beta * min(1.0, 1.0 / r) / 1.5
+                    else:
+                        if r < 0.5:
+                            beta = 2.0 * beta / (max(r, 0) + 1e-3)
+                        break
+            
+            x, x_nxt = x_nxt, x
+            self._record_trajectory(history, k, x)
+            self._checkpoint(history, k, x=x, g=g, beta=beta, mu=mu,
+                             cache_hits=problem.hits, cache_misses=problem.misses)
+        
+        history['oracle_cache'] = {'hits': problem.hits, 'misses': problem.misses}
+        run_time = self._finish(history, beta=beta, mu=mu)
+        
+        return x, run_time, history
+
+class StochasticAIM(Optimizer):
+    """
+    AIM on SVRG-style variance-reduced minibatch gradients
+
+    Each outer iteration (epoch) takes a snapshot of x with its full gradient,
+    then makes inner_iters steps along v = g_B(x) - g_B(x_snap) + g(x_snap),
+    with g_B the minibatch gradient of a freshly sampled batch B. To keep the
+    adaptive beta/mu logic away from sampling noise, the ratio r of each
+    trial step compares gradients of the same batch, the momentum direction
+    m is the same-batch gradient difference of the accepted step, and beta
+    grows by at most max_growth per step.
+
+    One epoch is logged per iteration. history['passes'] holds the effective
+    data passes (rows touched / m) at each logged epoch, and
+    history['effective_passes'] the total.
+    """
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.params.setdefault('batch_size', 1024)
+        self.params.setdefault('inner_iters', None)
+        self.params.setdefault('beta', 1.0)
+        self.params.setdefault('eta', 0.5)
+        self.params.setdefault('mu', 0.75)
+        self.params.setdefault('max_growth', 1.2)
+        self.params.setdefault('max_trials', 10)
+        self.params.setdefault('seed', 0)
+        self.params.setdefault('max_iter', 100)
+        self.params.setdefault('mtol', 1e-8)
+        self.params.setdefault('gtol', 1e-6)
+    
+    def optimize(self, problem, x0, monitor=None):
+        problem, history = self._start(problem, monitor)
+        
+        n_rows = problem.A.shape[0]
+        batch_size = min(self.params['batch_size'], n_rows)
+        # by default one epoch samples about as many rows as the data has
+        inner_iters = self.params['inner_iters'] or max(1, n_rows // batch_size)
+        
+        state = self._restore(problem, x0, history)
+        rng = np.random.default_rng(self.params['seed'])
+        if state is None:
+            x = x0.copy()
+            m = self._warm_value('m', np.zeros_like(x))
+            beta = self._warm_value('beta', self.params['beta'])
+            passes = 0.0
+            history['passes'] = []
+            self._record_trajectory(history, 0, x)
+            start = 1
+        else:
+            x, m, beta, passes = state['x'], state['m'], state['beta'], state['passes']
+            rng.bit_generator.state = state['rng']
+            start = state['k'] + 1
+        mu = self.params['mu']
+        eta = self.params['eta']
+        x_snap = np.empty_like(x)
+        v = np.empty_like(x)
+        direction = np.empty_like(x)
+        x_nxt = np.empty_like(x)
+        dx = np.empty_like(x)
+        dg = np.empty_like(x)
+        
+        for k in range(start, self.params['max_iter'] + 1):
+            loss, g_snap = self._evaluate(problem, x, history)
+            passes += 1
+            stop = self._log(history, x, loss, g_snap)
+            if history['iters'] and history['iters'][-1] == k:
+                history['passes'].append(passes)
+            if stop:
+                break
+            np.copyto(x_snap, x)
             
-        t_end = time.process_time()
-        run_time = t_end - t_start
+            for _ in range(inner_iters):
+                with self._phase('direction'):
+                    rows = np.sort(rng.integers(0, n_rows, batch_size))
+                    g_batch = problem.minibatch_gradient(x, rows)
+                    np.subtract(g_batch, problem.minibatch_gradient(x_snap, rows), out=v)
+                    v += g_snap
+                    project_out(v, m, mu, direction)
+                    evaluations = 2
+                
+                with self._phase('line_search'):
+                    for trial in range(self.params['max_trials']):
+                        np.copyto(x_nxt, x)
+                        axpy(-beta, direction, x_nxt)
+                        np.subtract(x, x_nxt, out=dx)
+                        # same batch on both sides, so the difference carries no sampling noise
+                        np.subtract(g_batch, problem.minibatch_gradient(x_nxt, rows), out=dg)
+                        evaluations += 1
+                        
+                        r_u = dot64(dx, dg) * beta
+                        r_d = dot64(dx, dx) + mu / (1 - mu) * dot64(m, dx)**2
+                        r = r_u / r_d
+                        if r > eta:
+                            beta = beta * min(1.0, 1.0 / r) / 1.5
+                        else:
+                            if r < 0.5:
+                                beta = beta * min(self.params['max_growth'], 2.0 / (max(r, 0) + 1e-3))
+                            break
+                
+                with self._phase('update'):
+                    norm_dg = np.linalg.norm(dg)
+                    if norm_dg > self.params['mtol']:
+                        np.multiply(dg, 1.0 / norm_dg, out=m)
+                    else:
+                        m.fill(0.0)
+                    x, x_nxt = x_nxt, x
+                    passes += evaluations * batch_size / n_rows
             
-        return x, run_time, history
\ No newline at end of file
+            self._record_trajectory(history, k, x)
+            self._checkpoint(history, k, x=x, m=m, beta=beta, passes=passes, rng=rng.bit_generator.state)
+        
+        history['effective_passes'] = passes
+        run_time = self._finish(history, beta=beta, m=m)
+        
+        return x, run_time, history
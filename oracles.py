@@ -0,0 +1,156 @@
+import numpy as np
+from problems import Problem
+
+class ProblemWrapper(Problem):
+    """
+    Base class for wrappers that add behaviour around another Problem while
+    exposing its data (A, b, l, ...) unchanged
+    """
+    def __init__(self, problem):
+        self.problem = problem
+    
+    def __getattr__(self, name):
+        # only reached for attributes the wrapper does not define itself
+        if name == 'problem':
+            raise AttributeError(name)
+        return getattr(self.problem, name)
+    
+    def loss(self, x):
+        return self.problem.loss(x)
+    
+    def gradient(self, x):
+        return self.problem.gradient(x)
+    
+    def loss_and_gradient(self, x):
+        return self.problem.loss_and_gradient(x)
+    
+    def hessian_vector_product(self, x, v):
+        return self.problem.hessian_vector_product(x, v)
+    
+    def loss_and_gradient_batch(self, X, **params):
+        return self.problem.loss_and_gradient_batch(X, **params)
+    
+    def gradient_batch(self, X, **params):
+        return self.problem.gradient_batch(X, **params)
+    
+    def minibatch_gradient(self, x, rows):
+        return self.problem.minibatch_gradient(x, rows)
+    
+    @property
+    def has_hvp(self):
+        return getattr(self.problem, 'has_hvp', False)
+    
+    def cache_key(self):
+        return self.problem.cache_key()
+
+class InstrumentedProblem(ProblemWrapper):
+    """
+    Counts oracle calls and the products with A they cost, and charges their
+    time to the 'oracle' phase of an Instrumentation
+    """
+    def __init__(self, problem, instrumentation):
+        super().__init__(problem)
+        self.instrumentation = instrumentation
+    
+    def _call(self, name, method, *args, n=1, **params):
+        # n is the number of evaluations a call performs (k for a batch of k)
+        before = getattr(self.problem, 'matvec_count', 0)
+        with self.instrumentation.phase('oracle'):
+            result = method(*args, **params)
+        self.instrumentation.count(name, n)
+        self.instrumentation.count('matvecs', getattr(self.problem, 'matvec_count', 0) - before)
+        return result
+    
+    def loss(self, x):
+        return self._call('loss', self.problem.loss, x)
+    
+    def gradient(self, x):
+        return self._call('gradient', self.problem.gradient, x)
+    
+    def loss_and_gradient(self, x):
+        return self._call('loss_and_gradient', self.problem.loss_and_gradient, x)
+    
+    def hessian_vector_product(self, x, v):
+        return self._call('hvp', self.problem.hessian_vector_product, x, v)
+    
+    def minibatch_gradient(self, x, rows):
+        return self._call('minibatch_gradient', self.problem.minibatch_gradient, x, rows)
+    
+    def loss_and_gradient_batch(self, X, **params):
+        return self._call('loss_and_gradient', self.problem.loss_and_gradient_batch, X, n=X.shape[1], **params)
+    
+    def gradient_batch(self, X, **params):
+        return self._call('gradient', self.problem.gradient_batch, X, n=X.shape[1], **params)
+    
+    def hessian_vector_product_batch(self, X, V, **params):
+        return self._call('hvp', self.problem.hessian_vector_product_batch, X, V, n=X.shape[1], **params)
+
+class CachedProblem(ProblemWrapper):
+    """
+    Memoizes loss and gradient values at the last `size` points
+
+    Points are matched exactly. A gradient miss at a point whose loss is not
+    known yet is served by loss_and_gradient, since the loss is nearly free
+    once A @ x is available. Cached gradients are returned read-only.
+    """
+    def __init__(self, problem, size=4):
+        super().__init__(problem)
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = []
+    
+    @staticmethod
+    def wrap(problem, size=4):
+        return problem if isinstance(problem, CachedProblem) else CachedProblem(problem, size)
+    
+    def _lookup(self, x):
+        for i in range(len(self._entries) - 1, -1, -1):
+            entry = self._entries[i]
+            if np.array_equal(entry['x'], x):
+                self._entries.append(self._entries.pop(i))
+                return entry
+        entry = {'x': x.copy(), 'loss': None, 'gradient': None}
+        self._entries.append(entry)
+        if len(self._entries) > self.size:
+            self._entries.pop(0)
+        return entry
+    
+    def _store_gradient(self, entry, grad):
+        grad.flags.writeable = False
+        entry['gradient'] = grad
+    
+    def loss(self, x):
+        entry = self._lookup(x)
+        if entry['loss'] is None:
+            self.misses += 1
+            entry['loss'] = self.problem.loss(x)
+        else:
+            self.hits += 1
+        return entry['loss']
+    
+    def gradient(self, x):
+        entry = self._lookup(x)
+        if entry['gradient'] is not None:
+            self.hits += 1
+        elif entry['loss'] is not None:
+            self.misses += 1
+            self._store_gradient(entry, self.problem.gradient(x))
+        else:
+            self.misses += 1
+            entry['loss'], grad = self.problem.loss_and_gradient(x)
+            self._store_gradient(entry, grad)
+        return entry['gradient']
+    
+    def loss_and_gradient(self, x):
+        entry = self._lookup(x)
+        if entry['gradient'] is not None and entry['loss'] is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry['loss'], grad = self.problem.loss_and_gradient(x)
+            self._store_gradient(entry, grad)
+        return entry['loss'], entry['gradient']
+    
+    def clear(self):
+        self._entries = []
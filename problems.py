@@ -1,72 +1,563 @@
+import copy
+import hashlib
 import numpy as np
+import scipy.sparse as sp
+from scipy.special import expit
 from abc import ABC, abstractmethod
+from kernels import COMPILED, smoothed_lp_curvature, smoothed_lp_penalty
+from matvec import ChunkedOperator, SparseOperator
+
+def _hash_array(h, a):
+    if sp.issparse(a):
+        a = a.tocsr()
+        h.update(f"csr{a.shape}".encode())
+        parts = (a.indptr, a.indices, a.data)
+    else:
+        parts = (np.asarray(a),)
+    for part in parts:
+        part = np.ascontiguousarray(part)
+        h.update(f"{part.dtype.str}{part.shape}".encode())
+        h.update(part.view(np.uint8).reshape(-1))
+
+# precision policies: dtype A is stored and multiplied in, and dtype of the
+# iterates and gradients. Loss reductions are carried out in float64 throughout
+PRECISIONS = {
+    'float64': (np.float64, np.float64),
+    'mixed': (np.float32, np.float64),
+    'float32': (np.float32, np.float32),
+}
 
 class Problem(ABC):
+    # attributes that, together with A and b, identify the problem in cache_key
+    key_params = ()
+    precision = 'float64'
+    dtype = np.float64
+    
     @abstractmethod
     def loss(self, w, **params): pass
     
     @abstractmethod
     def gradient(self, w, **params): pass
+    
+    def loss_and_gradient(self, w, **params):
+        return self.loss(w, **params), self.gradient(w, **params)
+    
+    def hessian_vector_product(self, w, v, **params):
+        raise NotImplementedError(f"{type(self).__name__} does not provide Hessian-vector products")
+    
+    @property
+    def has_hvp(self):
+        return type(self).hessian_vector_product is not Problem.hessian_vector_product
+    
+    def cache_key(self):
+        # content hash of A, b and the key_params values
+        if getattr(self, '_cache_key', None) is None:
+            h = hashlib.sha1(type(self).__name__.encode())
+            _hash_array(h, self.A)
+            _hash_array(h, self.b)
+            h.update(repr([(name, float(getattr(self, name))) for name in self.key_params]).encode())
+            self._cache_key = h.hexdigest()
+        return self._cache_key
+    
+    def with_params(self, **params):
+        """
+        The same problem with other values of key_params (e.g. l or epsilon),
+        sharing A, b and everything precomputed from them
+        """
+        unknown = sorted(set(params) - set(self.key_params))
+        if unknown:
+            raise TypeError(f"{type(self).__name__} has no parameter(s) {unknown}")
+        problem = copy.copy(self)
+        for name, value in params.items():
+            setattr(problem, name, value)
+        problem._cache_key = None
+        return problem
+    
+    def _column_params(self, X, params):
+        # key_params for a batch X (n, k), one value per column; params override
+        # the problem's own values with scalars or length-k sequences
+        unknown = sorted(set(params) - set(self.key_params))
+        if unknown:
+            raise TypeError(f"{type(self).__name__} has no per-column parameter(s) {unknown}")
+        k = X.shape[1]
+        return {name: np.broadcast_to(np.asarray(params.get(name, getattr(self, name)), dtype=np.float64), (k,))
+                for name in self.key_params}
+    
+    def loss_and_gradient_batch(self, X, **params):
+        """
+        Losses and gradients of k instances that share A and b, one per column
+        of X (n, k), evaluated with one matrix-matrix product per factor of the
+        gradient instead of k matrix-vector products. Keyword arguments give
+        per-column values of key_params (e.g. l=[1e-5, 1e-6, 1e-7])
+            Returns:
+                losses : ndarray (k,)
+                grads : ndarray (n, k)
+        """
+        return self._batch(X, self._column_params(X, params), with_loss=True)
+    
+    def gradient_batch(self, X, **params):
+        return self._batch(X, self._column_params(X, params), with_loss=False)[1]
+    
+    def _batch(self, X, params, with_loss):
+        raise NotImplementedError(f"{type(self).__name__} does not support batched evaluation")
+    
+    def minibatch_gradient(self, x, rows):
+        """
+        Unbiased estimate of the gradient at x from the rows of A (and entries
+        of b) indexed by rows; repeated rows count repeatedly
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not provide minibatch gradients")
+    
+    def _cached(self, x):
+        x_cached = getattr(self, '_x_cached', None)
+        return x_cached is not None and x_cached.shape == x.shape and np.array_equal(x_cached, x)
+    
+    def _matvec(self, x):
+        # A @ x at the most recent point is kept so that a gradient and a
+        # Hessian-vector product at the same x share one product
+        if not self._cached(x):
+            self._Ax_cached = self._product(x)
+            self._x_cached = x.copy()
+        return self._Ax_cached
+    
+    def _matvec_rproduct(self, x, f):
+        # z = A @ x (cached as in _matvec) and A^T @ f(z) in one call to the
+        # sparse engine when z is not cached yet; that is still two sweeps over
+        # A, as f needs all of z before the product with A^T can start
+        if self._operator is None or self._cached(x):
+            z = self._matvec(x)
+            return z, self._rproduct(f(z))
+        self.matvec_count += 2
+        z, y = self._operator.fused(x, f)
+        self._Ax_cached, self._x_cached = z, x.copy()
+        return z, y.astype(self.dtype, copy=False)
+    
+    # all products with A go through these two (and products with A^T A in
+    # Gram mode, see SmoothedLpL2Problem), so that matvec_count reflects the
+    # work done (a product with k columns counts k times)
+    matvec_count = 0
+    _operator = None
+    
+    def _set_precision(self, precision):
+        # stores A in the policy's dtype; call before _use_operator
+        if precision not in PRECISIONS:
+            raise ValueError(f"unknown precision {precision!r}, expected one of {sorted(PRECISIONS)}")
+        storage, self.dtype = PRECISIONS[precision]
+        self.precision = precision
+        self.A = self._store(self.A, storage)
+    
+    def _store(self, A, dtype):
+        return A.astype(dtype, copy=False)
+    
+    def _use_operator(self, threads):
+        # sparse A is multiplied by the threaded engine; dense A stays with BLAS
+        self._operator = SparseOperator(self.A, threads) if sp.issparse(self.A) else None
+    
+    def _product(self, v):
+        self.matvec_count += 1 if v.ndim == 1 else v.shape[1]
+        v = v.astype(self.A.dtype, copy=False)
+        return self.A @ v if self._operator is None else self._operator.matvec(v)
+    
+    def _rproduct(self, r):
+        self.matvec_count += 1 if r.ndim == 1 else r.shape[1]
+        r = r.astype(self.A.dtype, copy=False)
+        y = self.A.T @ r if self._operator is None else self._operator.rmatvec(r)
+        return y.astype(self.dtype, copy=False)
 
 class LogisticRegressionL2(Problem):
-    def __init__(self, A, b, l = 1.0):
-        self.A = A
+    key_params = ('l',)
+    
+    def __init__(self, A, b, l = 1.0, threads=None, precision='float64'):
+        self.A = A.tocsr() if sp.issparse(A) else A
         self.b = b
         self.l = l
+        self.m, self.n = A.shape
+        self._set_precision(precision)
+        self._use_operator(threads)
+        # workspaces reused by every oracle call
+        self._one_minus_b = 1.0 - np.asarray(b, dtype=np.float64)
+        self._work_m = np.empty(self.m)
+        self._work_n = np.empty(self.n)
     
-    def sigmoid(self, z):
-        return 1 / (1 + np.exp(-z))
+    def sigmoid(self, z, out=None):
+        return expit(z, out=out)
+    
+    def _logistic_loss(self, z):
+        # mean((1-b)*z + log(1+exp(-z))), with log(1+exp(-z)) = logaddexp(0, -z)
+        buf = np.negative(z, out=self._work_m)
+        np.logaddexp(0.0, buf, out=buf)
+        return (np.dot(self._one_minus_b, z) + buf.sum()) / self.m
+    
+    def _sigmoid_residual(self, z):
+        residual = self.sigmoid(z, out=self._work_m)
+        residual -= self.b
+        return residual
+    
+    def _gradient(self, x):
+        z, grad = self._matvec_rproduct(x, self._sigmoid_residual)
+        grad *= 1.0 / self.m
+        grad += np.multiply(x, self.l, out=self._work_n)
+        return z, grad
     
     def loss(self, x):
-        z = self.A @ x
-        logistic_loss = np.mean((1 - self.b) * z + np.log(1 + np.exp(-z)))
-        regularization = 0.5 * self.l * np.sum(x**2)
-        return logistic_loss + regularization
+        z = self._matvec(x)
+        return self._logistic_loss(z) + 0.5 * self.l * np.dot(x, x)
     
     def gradient(self, x):
-        pred = self.sigmoid(self.A @ x)
-        grad = self.A.T @ (pred - self.b) / len(self.b)
+        return self._gradient(x)[1]
+    
+    def loss_and_gradient(self, x):
+        z, grad = self._gradient(x)
+        loss = self._logistic_loss(z) + 0.5 * self.l * np.dot(x, x)
+        return loss, grad
+    
+    def hessian_vector_product(self, x, v):
+        # H = A^T diag(sigma(1-sigma)) A / m + l*I; v may hold several vectors as columns
+        weights = self.sigmoid(self._matvec(x), out=self._work_m)
+        weights -= weights**2
+        weights *= 1.0 / self.m
+        Av = self._product(v)
+        Av *= weights if Av.ndim == 1 else weights[:, None]
+        Hv = self._rproduct(Av)
+        Hv += self.l * v
+        return Hv
+    
+    def minibatch_gradient(self, x, rows):
+        # A_B^T (sigma(A_B x) - b_B) / |B| + l*x
+        A_rows = self.A[rows]
+        residual = self.sigmoid(A_rows @ x)
+        residual -= np.asarray(self.b)[rows]
+        grad = A_rows.T @ residual
+        grad *= 1.0 / len(rows)
         grad += self.l * x
         return grad
+    
+    def _batch(self, X, params, with_loss):
+        l = params['l']
+        Z = self._product(X)
+        losses = None
+        if with_loss:
+            losses = (self._one_minus_b @ Z + np.logaddexp(0.0, -Z).sum(axis=0, dtype=np.float64)) / self.m
+            losses += 0.5 * l * np.einsum('ij,ij->j', X, X)
+        residual = self.sigmoid(Z, out=Z)
+        residual -= np.asarray(self.b)[:, None]
+        grads = self._rproduct(residual)
+        grads *= 1.0 / self.m
+        grads += l * X
+        return losses, grads
+    
+    def hessian_vector_product_batch(self, X, V, **params):
+        # column j of the result is H(X[:, j]) @ V[:, j]
+        l = self._column_params(X, params)['l']
+        weights = self.sigmoid(self._product(X))
+        weights -= weights**2
+        weights *= 1.0 / self.m
+        AV = self._product(V)
+        AV *= weights
+        HV = self._rproduct(AV)
+        HV += l * V
+        return HV
+
+class ChunkedLogisticRegressionL2(LogisticRegressionL2):
+    """
+    LogisticRegressionL2 for a CSR matrix A larger than memory, typically
+    memory-mapped with datasets.load_arrays. Products with A stream over blocks
+    of rows (see matvec.ChunkedOperator); a gradient computes A @ x and
+    accumulates A^T (sigma(Ax) - b) block by block in a single pass over A, and
+    so does a Hessian-vector product at a point whose A @ x is cached.
+        Parameters:
+            chunk_bytes : int (default=64 MiB)
+                Size of the part of A held in each of the two block buffers
+            precision : str (default='float64')
+                As for the other problems, except that A stays memory-mapped
+                in its own dtype and each block is cast as it is loaded
+    """
+    def __init__(self, A, b, l = 1.0, chunk_bytes=64 << 20, precision='float64'):
+        if not sp.issparse(A):
+            raise TypeError("ChunkedLogisticRegressionL2 needs a sparse A")
+        self.chunk_bytes = chunk_bytes
+        super().__init__(A, b, l, precision=precision)
+    
+    def _store(self, A, dtype):
+        # A stays as it is, memory-mapped; the operator casts every block to
+        # the storage dtype as it loads it
+        self._storage = dtype
+        return A
+    
+    def _use_operator(self, threads):
+        self._operator = ChunkedOperator(self.A, self.chunk_bytes, self._storage)
+    
+    def _gradient(self, x):
+        if self._cached(x):
+            return super()._gradient(x)
+        self.matvec_count += 2
+        z = np.empty(self.m)
+        grad = np.zeros(self.n)
+        operand = x.astype(self._storage, copy=False)
+        for start, stop, block in self._operator.blocks():
+            z[start:stop] = block @ operand
+            residual = self.sigmoid(z[start:stop])
+            residual -= self.b[start:stop]
+            grad += block.T @ residual.astype(block.dtype, copy=False)
+        self._Ax_cached, self._x_cached = z, x.copy()
+        grad *= 1.0 / self.m
+        grad += self.l * x
+        return z, grad.astype(self.dtype, copy=False)
+    
+    def hessian_vector_product(self, x, v):
+        weights = self.sigmoid(self._matvec(x), out=self._work_m)
+        weights -= weights**2
+        weights *= 1.0 / self.m
+        self.matvec_count += 2 if v.ndim == 1 else 2 * v.shape[1]
+        Hv = np.zeros(v.shape)
+        operand = v.astype(self._storage, copy=False)
+        for start, stop, block in self._operator.blocks():
+            Av = block @ operand
+            Av *= weights[start:stop] if Av.ndim == 1 else weights[start:stop, None]
+            Hv += block.T @ Av
+        Hv += self.l * v
+        return Hv.astype(self.dtype, copy=False)
+
+# cost of a stored entry in a sparse product relative to a dense one,
+# measured with loss_and_gradient on the Config instances: G pays off for
+# n=500 and for n=1000, r=0.25, the products with A for the others
+SPARSE_ENTRY_COST = 2.5
+# largest n for which a dense G = A^T A is considered at all
+GRAM_MAX_N = 20000
 
-class SmoothedLpL2Problem:
-    def __init__(self, A, b, epsilon=1e-1, p=0.5):
-        self.A = A
+def gram_is_cheaper(A):
+    """
+    Whether a product with G = A^T A costs less than the products with A and A^T
+    it replaces, judged from the shape and density of A. The fill-in of G is
+    estimated as for uniformly scattered nonzeros; G counts as dense once more
+    than a quarter of it is filled
+    """
+    m, n = A.shape
+    if n > GRAM_MAX_N:
+        return False
+    if sp.issparse(A):
+        density = A.nnz / (m * n)
+        product_cost = 2 * SPARSE_ENTRY_COST * A.nnz
+    else:
+        density = 1.0
+        product_cost = 2 * m * n
+    # G[i, j] is zero only if no row of A holds both column i and column j
+    gram_density = 1.0 - (1.0 - density**2)**m
+    gram_cost = n * n if gram_density > 0.25 else SPARSE_ENTRY_COST * gram_density * n * n
+    return gram_cost < product_cost
+
+class SmoothedLpL2Problem(Problem):
+    """
+    0.5*||Ax - b||^2 + l * sum(s(x_i)^p), with s a smoothed absolute value
+        Parameters:
+            gram : bool or 'auto' (default='auto')
+                Precompute G = A^T A, A^T b and ||b||^2 and evaluate the least-squares
+                part from them, so that each oracle call costs one product with G
+                instead of one with A and one with A^T. 'auto' decides with
+                gram_is_cheaper
+    """
+    key_params = ('l', 'epsilon', 'p')
+    
+    def __init__(self, A, b, epsilon=1e-1, p=0.5, threads=None, gram='auto', precision='float64'):
+        self.A = A.tocsr() if sp.issparse(A) else A
         self.b = b
-        self.l = 0.2 * np.linalg.norm(A.T @ b, np.inf)
+        self._Atb = A.T @ b
+        self.l = 0.2 * np.linalg.norm(self._Atb, np.inf)
         self.epsilon = epsilon
         self.p = p
         self.m, self.n = A.shape
-        
-    def _s(self, x):
-        return np.where(
-            np.abs(x) > self.epsilon,
-            np.abs(x),
-            (x**2)/(2*self.epsilon) + self.epsilon/2
-        )
-    
-    def _ds_dx(self, x):
-        return np.where(
-            np.abs(x) > self.epsilon,
-            np.sign(x),
-            x/self.epsilon
-        )
+        self._set_precision(precision)
+        self._use_operator(threads)
+        self.gram = gram_is_cheaper(self.A) if gram == 'auto' else bool(gram)
+        if self.gram:
+            self._build_gram()
+        # workspaces reused by every oracle call
+        self._residual = np.empty(self.m)
+        self._abs_x = np.empty(self.n)
+        self._mask = np.empty(self.n, dtype=bool)
+        self._s_values = np.empty(self.n)
+        self._ds_values = np.empty(self.n)
+        self._work_n = np.empty(self.n)
+        self._warm_up()
     
-    def loss(self, x):
-        residual = self.A @ x - self.b
-        l2_term = 0.5 * np.sum(residual**2)
+    def with_params(self, **params):
+        problem = super().with_params(**params)
+        if 'p' in params:
+            problem._warm_up()
+        return problem
+    
+    def _warm_up(self):
+        # numba compiles (or loads from its cache) the penalty kernels for this
+        # p and dtype on their first call; make those calls here rather than
+        # in the first timed run
+        if COMPILED:
+            x = np.zeros(self.n, dtype=self.dtype)
+            self._penalty(x)
+            self._penalty(x, with_gradient=False)
+            smoothed_lp_curvature(x, self.epsilon, self.p, self.l, self._work_n)
+    
+    def _smooth(self, x):
+        # s(x) = |x| if |x| > epsilon else x^2/(2*epsilon) + epsilon/2, and s'(x);
+        # |x| and the mask are computed once and left in the workspace
+        abs_x, mask, s, ds = self._abs_x, self._mask, self._s_values, self._ds_values
+        np.abs(x, out=abs_x)
+        np.greater(abs_x, self.epsilon, out=mask)
         
-        s_values = self._s(x)
-        lp_term = self.l * np.sum(s_values**self.p)
+        np.multiply(x, x, out=s)
+        s *= 0.5 / self.epsilon
+        s += 0.5 * self.epsilon
+        np.copyto(s, abs_x, where=mask)
         
+        np.multiply(x, 1.0 / self.epsilon, out=ds)
+        np.sign(x, out=ds, where=mask)
+        return s, ds
+    
+    def _penalty(self, x, with_gradient=True):
+        # one compiled pass over x when numba is available, see kernels.smoothed_lp_penalty
+        if COMPILED:
+            grad = self._work_n if with_gradient else None
+            return smoothed_lp_penalty(x, self.epsilon, self.p, self.l, grad), grad
+        s, ds = self._smooth(x)
+        s_pow = np.power(s, self.p - 1, out=self._work_n)
+        lp_term = self.l * np.dot(s_pow, s)
+        if not with_gradient:
+            return lp_term, None
+        s_pow *= ds
+        s_pow *= self.l * self.p
+        return lp_term, s_pow
+    
+    def _build_gram(self):
+        # G stays in float64 whatever the precision, as the expanded form cancels
+        A = self.A.astype(np.float64, copy=False)
+        if sp.issparse(A):
+            AT = self._operator.AT if self._operator is not None and A is self.A else A.T.tocsr()
+            G = (AT @ A).tocsr()
+            self._G = G.toarray() if G.nnz > 0.25 * self.n * self.n else G
+        else:
+            self._G = A.T @ A
+        self._bb = float(np.dot(self.b, self.b))
+    
+    def _gram_product(self, v):
+        self.matvec_count += 1 if v.ndim == 1 else v.shape[1]
+        return self._G @ v
+    
+    def _gram_matvec(self, x):
+        # in Gram mode the single-slot cache of Problem._matvec holds G @ x instead
+        if not self._cached(x):
+            self._Ax_cached = self._gram_product(x)
+            self._x_cached = x.copy()
+        return self._Ax_cached
+    
+    def _subtract_b(self, z):
+        return np.subtract(z, self.b, out=self._residual)
+    
+    def _l2_residual(self, x):
+        return self._subtract_b(self._matvec(x))
+    
+    def _l2_term(self, x, with_gradient=True):
+        # 0.5*||Ax - b||^2 and, optionally, its gradient A^T(Ax - b)
+        if self.gram:
+            Gx = self._gram_matvec(x)
+            # expanded form; clipped since cancellation can push it below zero near b = Ax
+            l2_term = max(0.5 * np.dot(x, Gx) - np.dot(self._Atb, x) + 0.5 * self._bb, 0.0)
+            return l2_term, np.subtract(Gx, self._Atb).astype(self.dtype, copy=False) if with_gradient else None
+        if with_gradient:
+            _, grad = self._matvec_rproduct(x, self._subtract_b)
+            residual = self._residual
+        else:
+            residual, grad = self._l2_residual(x), None
+        return 0.5 * np.dot(residual, residual), grad
+    
+    def loss(self, x):
+        l2_term, _ = self._l2_term(x, with_gradient=False)
+        lp_term, _ = self._penalty(x, with_gradient=False)
         return l2_term + lp_term
     
     def gradient(self, x):
-        residual = self.A @ x - self.b
-        grad_l2 = self.A.T @ residual
+        _, grad = self._l2_term(x)
+        grad += self._penalty(x)[1]
+        return grad
+    
+    def loss_and_gradient(self, x):
+        l2_term, grad = self._l2_term(x)
+        lp_term, grad_lp = self._penalty(x)
+        grad += grad_lp
+        return l2_term + lp_term, grad
+    
+    def hessian_vector_product(self, x, v):
+        # H = A^T A + diag(l * d^2/dx^2 s(x)^p); v may hold several vectors as columns
+        curvature, work = self._work_n, self._abs_x
+        if COMPILED:
+            smoothed_lp_curvature(x, self.epsilon, self.p, self.l, curvature)
+        else:
+            s, ds = self._smooth(x)
+            np.multiply(ds, ds, out=curvature)
+            curvature *= self.p - 1
+            np.multiply(s, 1.0 / self.epsilon, out=work)
+            np.copyto(work, 0.0, where=self._mask)
+            curvature += work
+            curvature *= np.power(s, self.p - 2, out=work)
+            curvature *= self.l * self.p
         
-        s_values = self._s(x)
-        ds_dx = self._ds_dx(x)
-        grad_lp = self.l* self.p * (s_values**(self.p - 1)) * ds_dx
+        Hv = self._gram_product(v) if self.gram else self._rproduct(self._product(v))
+        if v.ndim == 1:
+            Hv += np.multiply(curvature, v, out=work)
+        else:
+            Hv += curvature[:, None] * v
+        return Hv.astype(self.dtype, copy=False)
+    
+    def minibatch_gradient(self, x, rows):
+        # the least-squares part is a sum over rows, so the sampled rows are scaled by m/|B|
+        A_rows = self.A[rows]
+        residual = A_rows @ x
+        residual -= np.asarray(self.b)[rows]
+        grad = A_rows.T @ residual
+        grad *= self.m / len(rows)
+        grad += self._penalty(x)[1]
+        return grad
+    
+    @staticmethod
+    def _smooth_batch(X, epsilon):
+        # _smooth for a batch, with epsilon given per column
+        abs_X = np.abs(X)
+        mask = abs_X > epsilon
+        S = np.where(mask, abs_X, X * X * (0.5 / epsilon) + 0.5 * epsilon)
+        dS = np.where(mask, np.sign(X), X / epsilon)
+        return S, dS, mask
+    
+    def _batch(self, X, params, with_loss):
+        l, epsilon, p = params['l'], params['epsilon'], params['p']
+        losses = None
+        if self.gram:
+            GX = self._gram_product(X)
+            grads = GX - self._Atb[:, None]
+            if with_loss:
+                losses = 0.5 * np.einsum('ij,ij->j', X, GX) - self._Atb @ X + 0.5 * self._bb
+                np.maximum(losses, 0.0, out=losses)
+        else:
+            R = self._product(X)
+            R -= np.asarray(self.b)[:, None]
+            grads = self._rproduct(R)
+            if with_loss:
+                losses = 0.5 * np.einsum('ij,ij->j', R, R)
         
-        return grad_l2 + grad_lp
\ No newline at end of file
+        S, dS, _ = self._smooth_batch(X, epsilon)
+        S_pow = S ** (p - 1)
+        if with_loss:
+            losses += l * np.einsum('ij,ij->j', S_pow, S)
+        S_pow *= dS
+        S_pow *= l * p
+        grads += S_pow
+        return losses, grads
+    
+    def hessian_vector_product_batch(self, X, V, **params):
+        # column j of the result is H(X[:, j]) @ V[:, j]
+        c = self._column_params(X, params)
+        l, epsilon, p = c['l'], c['epsilon'], c['p']
+        S, dS, mask = self._smooth_batch(X, epsilon)
+        curvature = (p - 1) * dS**2 + np.where(mask, 0.0, S / epsilon)
+        curvature *= S ** (p - 2)
+        curvature *= l * p
+        HV = self._gram_product(V) if self.gram else self._rproduct(self._product(V))
+        HV += curvature * V
+        return HV
\ No newline at end of file
@@ -0,0 +1,214 @@
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections.abc import Mapping
+import numpy as np
+
+# per-iteration history entries and the types they are stored with
+HISTORY_COLUMNS = {'iters': np.int64, 'losses': np.float64, 'grad_norms': np.float64, 'times': np.float64}
+
+# target gaps whose time to target is kept in the index, so that summaries
+# of stored runs need not read their histories
+TARGET_GAPS = tuple(10.0**-k for k in range(1, 13))
+
+def gap_key(target_gap):
+    return format(target_gap, '.0e')
+
+def time_to_target(times, losses, f_star, target_gap):
+    # wall time of the first logged iteration whose gap is below target_gap, or None
+    reached = np.flatnonzero(np.asarray(losses) - f_star <= target_gap)
+    return float(times[reached[0]]) if len(reached) else None
+
+def typed_history(history):
+    # history with its per-iteration lists turned into typed arrays
+    history = dict(history)
+    for name, dtype in HISTORY_COLUMNS.items():
+        if name in history:
+            history[name] = np.asarray(history[name], dtype=dtype)
+    return history
+
+def _jsonable(value):
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return getattr(value, '__name__', repr(value))
+
+def _lookup(record, key):
+    # nested fields are addressed with dots, e.g. 'counts.matvecs' or 'config.p'
+    for part in key.split('.'):
+        if not isinstance(record, dict) or part not in record:
+            return None
+        record = record[part]
+    return record
+
+class LazyHistory(Mapping):
+    """
+    The history of a stored run. Every access reads just the requested entry
+    from disk and nothing is kept, so that going over many runs does not
+    leave their histories in memory
+    """
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
+        self._names = None
+    
+    def _keys(self):
+        if self._names is None:
+            self._names = self.store.history_names(self.run_id)
+        return self._names
+    
+    def __getitem__(self, key):
+        if key not in self._keys():
+            raise KeyError(key)
+        return self.store.load_history(self.run_id, (key,))[key]
+    
+    def __contains__(self, key):
+        return key in self._keys()
+    
+    def __iter__(self):
+        return iter(self._keys())
+    
+    def __len__(self):
+        return len(self._keys())
+
+class ResultStore:
+    """
+    Append-only store of optimizer runs in a directory
+
+    index.jsonl holds one record per run: its name, the problem config, the
+    optimizer params, timings, oracle counts and final values, and, when the
+    run comes with its f_star, its time to each of TARGET_GAPS. The history
+    arrays of a run live in runs/<id>.npz and are only read when asked for.
+    A record is appended with a single write once its history is on disk, so
+    several processes can add runs to the same store.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self._records = []
+        self._offset = 0
+    
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.jsonl')
+    
+    def _history_path(self, run_id):
+        return os.path.join(self.directory, 'runs', run_id + '.npz')
+    
+    def append(self, name, run_time, history, **meta):
+        """
+        Store a run; meta holds extra fields of its record (e.g. config, params)
+            Returns:
+                run_id : str
+        """
+        run_id = uuid.uuid4().hex
+        arrays = {key: np.asarray(history[key], dtype=dtype)
+                  for key, dtype in HISTORY_COLUMNS.items() if key in history}
+        if history.get('trajectories'):
+            arrays['trajectories'] = np.stack(history['trajectories'])
+        runs = os.path.dirname(self._history_path(run_id))
+        os.makedirs(runs, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=runs, suffix='.npz')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self._history_path(run_id))
+        
+        stats = history.get('stats', {})
+        record = {
+            'id': run_id,
+            'name': name,
+            'created': time.time(),
+            'run_time': run_time,
+            'cpu_time': stats.get('cpu_time'),
+            'iterations': history.get('n_iter'),
+            'final_loss': history.get('final_loss'),
+            'final_grad_norm': history.get('final_grad_norm'),
+            'final_loss_fp64': history.get('final_loss_fp64'),
+            'stop_reason': history.get('stop_reason'),
+            'counts': stats.get('counts', {}),
+            'phase_wall': stats.get('phase_wall', {}),
+            'oracle_cache': history.get('oracle_cache'),
+        }
+        record.update(meta)
+        f_star = meta.get('f_star')
+        if f_star is not None and np.isfinite(f_star) and 'times' in arrays:
+            record['time_to_target'] = {gap_key(gap): time_to_target(arrays['times'], arrays['losses'], f_star, gap)
+                                        for gap in TARGET_GAPS}
+        line = json.dumps(_jsonable(record)) + '\n'
+        with open(self.index_path, 'a') as f:
+            f.write(line)
+        return run_id
+    
+    def records(self):
+        # all records, reading only what was appended since the last call
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith('\n'):
+                        break  # a record still being written
+                    self._records.append(json.loads(line))
+                    self._offset += len(line.encode())
+        return self._records
+    
+    def query(self, records=None, **filters):
+        """
+        Records whose fields equal the given values, e.g. query(name='AIM_Hg',
+        config__p=1.0); nested fields are separated by '__'. A callable value
+        is used as a predicate instead
+        """
+        records = self.records() if records is None else records
+        matches = []
+        for record in records:
+            for key, wanted in filters.items():
+                value = _lookup(record, key.replace('__', '.'))
+                if not (wanted(value) if callable(wanted) else value == wanted):
+                    break
+            else:
+                matches.append(record)
+        return matches
+    
+    def column(self, key, records=None):
+        # one field of every record as an array; missing numeric values are NaN
+        records = self.records() if records is None else records
+        values = [_lookup(record, key) for record in records]
+        if all(value is None or isinstance(value, (int, float)) for value in values):
+            return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        return np.array(values, dtype=object)
+    
+    def aggregate(self, key, by=('name',), func=np.mean, records=None, **filters):
+        """
+        func over the values of field key, grouped by the fields in by
+            Returns:
+                dict
+                    Tuple of group values -> aggregate
+        """
+        records = self.query(records, **filters)
+        groups = {}
+        for record in records:
+            group = tuple(_jsonable(_lookup(record, field)) for field in by)
+            groups.setdefault(json.dumps(group), (group, []))[1].append(record)
+        return {tuple(group): func(self.column(key, members)) for group, members in groups.values()}
+    
+    def history_names(self, run_id):
+        with np.load(self._history_path(run_id), allow_pickle=False) as data:
+            return list(data.files)
+    
+    def load_history(self, run_id, names=None):
+        # the whole history of a run, or only the entries in names
+        with np.load(self._history_path(run_id), allow_pickle=False) as data:
+            history = {name: data[name] for name in (data.files if names is None else names)}
+        if 'trajectories' in history:
+            history['trajectories'] = list(history['trajectories'])
+        return history
+    
+    def history(self, record):
+        return LazyHistory(self, record['id'])
@@ -0,0 +1,203 @@
+import argparse
+import glob
+import multiprocessing as mp
+import os
+import runpy
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+import numpy as np
+import optimizers
+from analyzer import BenchmarkSolver, ResultAnalyzer, render_convergence_plots
+from datasets import (GENERATED_CACHE_ROOT, default_cache_dir, generated_cache_dir, load_arrays,
+                      load_generated, load_svmlight_cached)
+from problems import ChunkedLogisticRegressionL2, LogisticRegressionL2, SmoothedLpL2Problem
+
+# NUMBA_NUM_THREADS sizes the pool of the parallel kernels in kernels.py
+BLAS_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                 'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS', 'NUMBA_NUM_THREADS')
+
+_worker_problems = {}
+_worker_limits = None
+
+def parse_config_name(path):
+    """
+    Problem description encoded in a Config file name, e.g.
+    'p=0.5,m=1000,n=500,r=0.15' or 'lambda=1e-6'
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    fields = dict(item.split('=') for item in name.split(','))
+    if 'lambda' in fields:
+        return {'kind': 'logreg', 'l': float(fields['lambda'])}
+    return {'kind': 'lp', 'p': float(fields['p']), 'm': int(fields['m']),
+            'n': int(fields['n']), 'r': float(fields['r'])}
+
+def load_config(path):
+    names = {name: getattr(optimizers, name) for name in dir(optimizers) if not name.startswith('_')}
+    return runpy.run_path(path, init_globals=names)['optimizers']
+
+def prepare_data(spec, dataset, data_root, seed=42):
+    """
+    Write the data of a problem spec to an on-disk cache that workers memory-map,
+    and return the spec extended with its cache directory
+    """
+    spec = dict(spec)
+    if spec['kind'] == 'logreg':
+        load_svmlight_cached(dataset)
+        spec['data'] = default_cache_dir(dataset)
+    else:
+        load_generated(spec['m'], spec['n'], spec['r'], seed, cache_root=data_root)
+        spec['data'] = generated_cache_dir(spec['m'], spec['n'], spec['r'], seed, cache_root=data_root)
+    return spec
+
+def build_problem(spec):
+    key = tuple(sorted(spec.items()))
+    if key not in _worker_problems:
+        A, b = load_arrays(spec['data'], mmap_mode='r')
+        precision = spec.get('precision', 'float64')
+        if spec['kind'] == 'logreg' and spec.get('chunk_bytes'):
+            problem = ChunkedLogisticRegressionL2(A, (b == 1).astype(int), spec['l'], spec['chunk_bytes'],
+                                                  precision=precision)
+        elif spec['kind'] == 'logreg':
+            problem = LogisticRegressionL2(A, (b == 1).astype(int), spec['l'], precision=precision)
+        else:
+            problem = SmoothedLpL2Problem(A, np.asarray(b), p=spec['p'], precision=precision)
+        _worker_problems[key] = problem
+    return _worker_problems[key]
+
+def _init_worker(threads):
+    global _worker_limits
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    _worker_limits = threadpool_limits(limits=threads)
+
+@contextmanager
+def worker_pool(workers=None, threads_per_worker=None):
+    """
+    Spawned process pool whose workers use threads_per_worker BLAS threads each
+    (cpu_count // workers by default) and cache problems with build_problem
+    """
+    workers = workers or os.cpu_count()
+    threads_per_worker = threads_per_worker or max(1, os.cpu_count() // workers)
+    # spawned workers read the thread limits from the environment when they import numpy
+    saved_env = {var: os.environ.get(var) for var in BLAS_ENV_VARS}
+    os.environ.update({var: str(threads_per_worker) for var in BLAS_ENV_VARS})
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(threads_per_worker,)) as pool:
+            yield pool
+    finally:
+        for var, value in saved_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+def _reference_spec(spec):
+    # the same problem in float64, which reference solutions and accuracy are measured on
+    return {key: value for key, value in spec.items() if key != 'precision'}
+
+def _run_optimizer(spec, name, optimizer):
+    problem = build_problem(spec)
+    x0 = np.zeros(problem.A.shape[1], dtype=problem.dtype)
+    x, run_time, history = optimizer.optimize(problem, x0)
+    if 'precision' in spec:
+        history['final_loss_fp64'] = build_problem(_reference_spec(spec)).loss(x.astype(np.float64))
+    return name, run_time, history, optimizer.params
+
+def _run_baseline(spec):
+    problem = build_problem(_reference_spec(spec))
+    return BenchmarkSolver.find_optimal(problem, np.zeros(problem.A.shape[1]))
+
+def run_benchmarks(config_paths, dataset='Data/real-sim', workers=None, threads_per_worker=None,
+                   data_root=GENERATED_CACHE_ROOT, store=None, chunk_bytes=None, precision='float64'):
+    """
+    Run every (config, optimizer) pair of the given Config files on a process pool
+        Parameters:
+            config_paths : list of str
+                Config files; the problem is read from the file name
+            dataset : str (default='Data/real-sim')
+                svmlight file used by the lambda=* configs
+            workers : int (default=None)
+                Number of worker processes, os.cpu_count() by default
+            threads_per_worker : int (default=None)
+                BLAS threads per worker, cpu_count // workers by default
+            data_root : str
+                Where generated instances are stored for the workers to memory-map
+            store : str or None
+                ResultStore directory every run is appended to
+            chunk_bytes : int or None
+                Stream the dataset of the lambda=* configs from disk in row blocks
+                of this size (ChunkedLogisticRegressionL2) instead of holding it
+                in memory
+            precision : str (default='float64')
+                problems.PRECISIONS policy of the runs; the final loss of each run
+                is also evaluated in float64 and reported next to the gap
+
+        Returns:
+            analyzers : dict
+                Config path -> ResultAnalyzer holding the results of its optimizers
+    """
+    specs = {path: prepare_data(parse_config_name(path), dataset, data_root) for path in config_paths}
+    if chunk_bytes:
+        for spec in specs.values():
+            if spec['kind'] == 'logreg':
+                spec['chunk_bytes'] = chunk_bytes
+    if precision != 'float64':
+        for spec in specs.values():
+            spec['precision'] = precision
+    configs = {path: load_config(path) for path in config_paths}
+    
+    with worker_pool(workers, threads_per_worker) as pool:
+        baselines = {pool.submit(_run_baseline, spec): path for path, spec in specs.items()}
+        runs = {pool.submit(_run_optimizer, specs[path], name, optimizer): path
+                for path, config in configs.items() for name, optimizer in config.items()}
+        
+        optimal = {baselines[future]: future.result() for future in as_completed(baselines)}
+        results = {path: {} for path in config_paths}
+        for future in as_completed(runs):
+            name, run_time, history, params = future.result()
+            results[runs[future]][name] = (run_time, history, params)
+    
+    analyzers = {}
+    for path, spec in specs.items():
+        problem = build_problem(spec)
+        config = {key: value for key, value in specs[path].items() if key != 'data'}
+        config['path'] = path
+        analyzer = ResultAnalyzer(problem, np.zeros(problem.A.shape[1]), optimal=optimal[path],
+                                  store=store, config=config)
+        for name in configs[path]:
+            run_time, history, params = results[path][name]
+            analyzer.add_result(name, run_time, history, params=params)
+        analyzers[path] = analyzer
+    return analyzers
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Config files in parallel")
+    parser.add_argument('configs', nargs='*', help="Config files (default: the whole Config/ grid)")
+    parser.add_argument('--dataset', default='Data/real-sim')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads-per-worker', type=int, default=None)
+    parser.add_argument('--store', default=None, help="ResultStore directory to append the runs to")
+    parser.add_argument('--plots', default=None, help="Directory to write convergence plots to")
+    parser.add_argument('--precision', default='float64', choices=['float64', 'mixed', 'float32'],
+                        help="Store A and run products in float32 ('mixed'), or also the iterates ('float32')")
+    parser.add_argument('--chunk-mb', type=float, default=None,
+                        help="Stream the svmlight dataset from disk in row blocks of this many MiB")
+    args = parser.parse_args()
+    
+    config_paths = args.configs or sorted(glob.glob('Config/p=*/*.py') + glob.glob('Config/lambda=*.py'))
+    analyzers = run_benchmarks(config_paths, args.dataset, args.workers, args.threads_per_worker,
+                               store=args.store,
+                               chunk_bytes=args.chunk_mb and int(args.chunk_mb * (1 << 20)),
+                               precision=args.precision)
+    for path, analyzer in analyzers.items():
+        print(f"=== {path} ===")
+        analyzer.print_table()
+    if args.plots:
+        render_convergence_plots({os.path.join(args.plots, os.path.splitext(os.path.basename(path))[0] + '.png'): analyzer
+                                  for path, analyzer in analyzers.items()}, workers=args.workers)
+
+if __name__ == "__main__":
+    main()
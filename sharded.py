@@ -0,0 +1,205 @@
+import multiprocessing as mp
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+import scipy.sparse as sp
+from matvec import _partition
+from problems import LogisticRegressionL2
+
+# commands understood by the shards; the l-terms are added by the caller
+LOSS, GRADIENT, LOSS_AND_GRADIENT, HVP = 'loss', 'gradient', 'loss_and_gradient', 'hvp'
+
+def _shard_bounds(A, shards):
+    # rows of a dense A all count the same
+    indptr = A.tocsr().indptr if sp.issparse(A) else np.arange(A.shape[0] + 1)
+    return _partition(indptr, shards)
+
+def _evaluate_shard(problem, weight, command, x, v, out):
+    """
+    Writes the shard's share of the data term into out: the gradient or HVP in
+    out[:-2], the loss in out[-2] and the products with A it took in out[-1],
+    all scaled by weight = shard rows / total rows
+    """
+    before = problem.matvec_count
+    out[:-2] = 0.0
+    out[-2] = 0.0
+    if command == LOSS:
+        out[-2] = problem.loss(x)
+    elif command == GRADIENT:
+        out[:-2] = problem.gradient(x)
+    elif command == LOSS_AND_GRADIENT:
+        out[-2], out[:-2] = problem.loss_and_gradient(x)
+    elif command == HVP:
+        out[:-2] = problem.hessian_vector_product(x, v)
+    else:
+        raise ValueError(f"unknown command {command!r}")
+    out[:-1] *= weight
+    out[-1] = weight * (problem.matvec_count - before)
+
+class LocalTransport:
+    """
+    Runs the shards one after the other in the calling process; a stand-in for
+    SharedMemoryTransport with the same results, for tests and debugging
+    """
+    def __init__(self, shards, n, threads=1, precision='float64'):
+        self.n = n
+        self._shards = [(LogisticRegressionL2(A, b, 0.0, threads, precision), weight) for A, b, weight in shards]
+        self._partial = np.zeros((len(self._shards), n + 2))
+    
+    def allreduce(self, command, x, v=None):
+        for (problem, weight), out in zip(self._shards, self._partial):
+            _evaluate_shard(problem, weight, command, x, v, out)
+        return self._partial.sum(axis=0)
+    
+    def close(self):
+        self._shards = []
+
+def _worker(conn, name, n, shards, index, A, b, weight, threads, precision):
+    # attached only: the parent owns the block and unlinks it
+    block = shared_memory.SharedMemory(name=name)
+    buf = np.ndarray((2 + shards, n + 2), dtype=np.float64, buffer=block.buf)
+    x, v, out = buf[0, :n], buf[1, :n], buf[2 + index]
+    problem = LogisticRegressionL2(A, b, 0.0, threads, precision)
+    del A, b
+    try:
+        while True:
+            command = conn.recv()
+            if command is None:
+                break
+            try:
+                _evaluate_shard(problem, weight, command, x, v, out)
+                conn.send(None)
+            except Exception as e:
+                conn.send(e)
+    finally:
+        del x, v, out, buf
+        block.close()
+
+def _shutdown(processes, conns, block):
+    for conn in conns:
+        try:
+            conn.send(None)
+        except OSError:
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    try:
+        block.close()
+    except BufferError:
+        pass  # views of the block are still alive; the mapping goes with them
+    block.unlink()
+
+class SharedMemoryTransport:
+    """
+    One spawned process per shard. x (and v) are broadcast through a block of
+    shared memory, each shard writes its partial result into its own row of
+    the block, and the rows are summed in a fixed order, so that results do
+    not depend on timing. Pipes only carry the commands
+    """
+    def __init__(self, shards, n, threads=1, precision='float64'):
+        self.n = n
+        k = len(shards)
+        self._block = shared_memory.SharedMemory(create=True, size=(2 + k) * (n + 2) * 8)
+        self._buf = np.ndarray((2 + k, n + 2), dtype=np.float64, buffer=self._block.buf)
+        self._x, self._v, self._partial = self._buf[0, :n], self._buf[1, :n], self._buf[2:]
+        context = mp.get_context('spawn')
+        self._conns, self._processes = [], []
+        for index, (A, b, weight) in enumerate(shards):
+            parent, child = context.Pipe()
+            process = context.Process(target=_worker, daemon=True,
+                                      args=(child, self._block.name, n, k, index, A, b, weight, threads, precision))
+            process.start()
+            child.close()
+            self._conns.append(parent)
+            self._processes.append(process)
+        self._finalizer = weakref.finalize(self, _shutdown, self._processes, self._conns, self._block)
+    
+    def allreduce(self, command, x, v=None):
+        np.copyto(self._x, x)
+        if v is not None:
+            np.copyto(self._v, v)
+        for conn in self._conns:
+            conn.send(command)
+        errors = [error for error in (conn.recv() for conn in self._conns) if error is not None]
+        if errors:
+            raise errors[0]
+        return self._partial.sum(axis=0)
+    
+    def close(self):
+        self._x = self._v = self._partial = self._buf = None
+        self._finalizer()
+
+TRANSPORTS = {'shared_memory': SharedMemoryTransport, 'local': LocalTransport}
+
+class ShardedLogisticRegressionL2(LogisticRegressionL2):
+    """
+    LogisticRegressionL2 whose rows are split over worker processes
+
+    Every shard evaluates its part of the data term (losses, A_s^T (sigma(A_s x)
+    - b_s) and Hessian-vector products) on its own rows, keeping its own cache
+    of A_s @ x, and the parts are combined by an all-reduce; the l-terms are
+    added here. Minibatch and batched evaluations stay in this process.
+    Pickling yields the unsharded LogisticRegressionL2.
+        Parameters:
+            shards : int (default=2)
+                Number of row blocks, balanced by nonzeros
+            transport : str (default='shared_memory')
+                'shared_memory' runs one process per shard, 'local' runs the
+                shards in this process (see LocalTransport)
+            threads : int (default=1)
+                Threads of the sparse products within each shard
+            precision : str (default='float64')
+                problems.PRECISIONS policy of the shards; partial results are
+                reduced in float64
+    """
+    def __init__(self, A, b, l = 1.0, shards=2, transport='shared_memory', threads=1, precision='float64'):
+        super().__init__(A, b, l, threads=1, precision=precision)
+        b = np.asarray(b)
+        parts = [(self.A[start:stop], b[start:stop], (stop - start) / self.m)
+                 for start, stop in _shard_bounds(self.A, shards)]
+        self.shards = len(parts)
+        self.transport = TRANSPORTS[transport](parts, self.n, threads, precision)
+    
+    def _use_operator(self, threads):
+        # only the minibatch and batched paths multiply by A here
+        self._operator = None
+    
+    def __reduce__(self):
+        return LogisticRegressionL2, (self.A, self.b, self.l, None, self.precision)
+    
+    def close(self):
+        self.transport.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def _allreduce(self, command, x, v=None):
+        total = self.transport.allreduce(command, x, v)
+        self.matvec_count += int(round(total[-1]))
+        return total[-2], total[:-2].astype(self.dtype)
+    
+    def loss(self, x):
+        loss, _ = self._allreduce(LOSS, x)
+        return loss + 0.5 * self.l * np.dot(x, x)
+    
+    def gradient(self, x):
+        _, grad = self._allreduce(GRADIENT, x)
+        grad += self.l * x
+        return grad
+    
+    def loss_and_gradient(self, x):
+        loss, grad = self._allreduce(LOSS_AND_GRADIENT, x)
+        grad += self.l * x
+        return loss + 0.5 * self.l * np.dot(x, x), grad
+    
+    def hessian_vector_product(self, x, v):
+        if v.ndim != 1:
+            return np.column_stack([self.hessian_vector_product(x, column) for column in v.T])
+        _, Hv = self._allreduce(HVP, x, v)
+        Hv += self.l * v
+        return Hv
@@ -0,0 +1,166 @@
+import argparse
+import itertools
+import os
+import numpy as np
+import optimizers
+from datasets import GENERATED_CACHE_ROOT
+from monitors import Monitor
+from runner import build_problem, load_config, parse_config_name, prepare_data, worker_pool
+
+# step-size parameters searched on a log scale around the optimizer's own value
+LOG_PARAMS = ('lr', 'initial_lr')
+
+def default_grid(optimizer, num=9, decades=2.0):
+    """
+    Candidate values of the step-size parameters the optimizer has: num values
+    of lr/initial_lr spanning decades powers of ten on either side of its
+    current value, and momentum 1 - q for q log-spaced in [0.01, 0.5]
+        Returns:
+            grid : dict
+                Parameter name -> candidate values
+    """
+    grid = {name: optimizer.params[name] * np.logspace(-decades, decades, num)
+            for name in LOG_PARAMS if name in optimizer.params}
+    if 'momentum' in optimizer.params:
+        grid['momentum'] = 1.0 - np.geomspace(0.01, 0.5, 5)
+    return grid
+
+class _Divergence:
+    # stops a run once its gradient norm is no longer finite or has grown by blowup
+    def __init__(self, blowup=1e6):
+        self.blowup = blowup
+        self.first = None
+    
+    def __call__(self, k, x, info):
+        grad_norm = info['grad_norm']
+        if self.first is None:
+            self.first = grad_norm
+        return not np.isfinite(grad_norm) or grad_norm > self.blowup * self.first
+
+def _score(spec, optimizer_class, params, budget):
+    """
+    Runs one candidate for budget iterations. Lower scores are better: runs that
+    reached gtol rank first, by iterations, the others by their final loss
+    """
+    problem = build_problem(spec)
+    optimizer = getattr(optimizers, optimizer_class)(**dict(params, max_iter=budget))
+    monitor = Monitor(log_every=0, callbacks=[_Divergence()])
+    with np.errstate(all='ignore'):
+        x, _, history = optimizer.optimize(problem, np.zeros(problem.A.shape[1], dtype=problem.dtype), monitor)
+        loss = problem.loss(x)
+    if history.get('stop_reason') == 'gtol':
+        return 0, history['n_iter']
+    return 1, loss if np.isfinite(loss) else np.inf
+
+def _prunes(n, eta):
+    # rounds of keeping the best 1/eta needed to get from n candidates to one
+    rounds = 0
+    while n > 1:
+        n = max(1, n // eta)
+        rounds += 1
+    return rounds
+
+def successive_halving(pool, tasks, min_iter=20, max_iter=1000, eta=3):
+    """
+    Successive halving over several searches at once, so that every round
+    fills the pool. In each round the live candidates of a search run with
+    the search's budget and the best 1/eta survive; the budget grows by eta
+    per round and reaches max_iter in the round that leaves one candidate.
+    Runs that diverge are stopped at once
+        Parameters:
+            pool : concurrent.futures.Executor
+                A runner.worker_pool
+            tasks : dict
+                key -> (spec, optimizer, grid); optimizer gives the class and the
+                parameters that are not searched, grid the searched values
+            min_iter : int (default=20)
+                Smallest budget of a first round
+
+        Returns:
+            best : dict
+                key -> params of the winner
+            rounds : list of dict
+                Per key, the budget and the (params, score) pairs of every round
+    """
+    live, remaining, best = {}, {}, {}
+    for key, (spec, optimizer, grid) in tasks.items():
+        names = list(grid)
+        live[key] = [dict(optimizer.params, **dict(zip(names, values)))
+                     for values in itertools.product(*grid.values())]
+        remaining[key] = _prunes(len(live[key]), eta)
+    rounds = []
+    while live:
+        budgets = {key: max(min_iter, int(max_iter / eta**(remaining[key] - 1))) for key in live}
+        futures = {key: [pool.submit(_score, tasks[key][0], type(tasks[key][1]).__name__, params, budgets[key])
+                         for params in candidates] for key, candidates in live.items()}
+        scores = {key: [future.result() for future in pending] for key, pending in futures.items()}
+        rounds.append({key: {'budget': budgets[key], 'results': list(zip(live[key], scores[key]))}
+                       for key in live})
+        for key in list(live):
+            order = sorted(range(len(live[key])), key=scores[key].__getitem__)
+            live[key] = [live[key][i] for i in order[:max(1, len(order) // eta)]]
+            remaining[key] -= 1
+            if len(live[key]) == 1:
+                best[key] = live.pop(key)[0]
+    return best, rounds
+
+def format_config(optimizers_by_name):
+    # a Config file defining the given optimizers, with the params that differ from the defaults
+    lines = []
+    for name, optimizer in optimizers_by_name.items():
+        defaults = type(optimizer)().params
+        args = ', '.join(f"{key}={value:.3g}" if isinstance(value, float) else f"{key}={value!r}"
+                         for key, value in optimizer.params.items()
+                         if key not in defaults or defaults[key] != value)
+        lines.append(f'    "{name}": {type(optimizer).__name__}({args})')
+    return "optimizers = {\n" + ",\n".join(lines) + "\n}\n"
+
+def tune_configs(config_paths, out_dir, dataset='Data/real-sim', workers=None, threads_per_worker=None,
+                 min_iter=20, max_iter=1000, eta=3, data_root=GENERATED_CACHE_ROOT):
+    """
+    Tune the step sizes of every optimizer of the given Config files with
+    successive halving over default_grid, starting from the values in the
+    files, and write the files with the winners to out_dir (same file names)
+        Returns:
+            rounds : list of dict
+                As returned by successive_halving, keyed by (config path, name)
+    """
+    specs = {path: prepare_data(parse_config_name(path), dataset, data_root) for path in config_paths}
+    configs = {path: load_config(path) for path in config_paths}
+    tasks = {(path, name): (specs[path], optimizer, default_grid(optimizer))
+             for path, config in configs.items() for name, optimizer in config.items()}
+    searched = {key: task for key, task in tasks.items() if task[2]}
+    
+    with worker_pool(workers, threads_per_worker) as pool:
+        best, rounds = successive_halving(pool, searched, min_iter, max_iter, eta)
+    
+    os.makedirs(out_dir, exist_ok=True)
+    for path, config in configs.items():
+        tuned = {}
+        for name, optimizer in config.items():
+            params = dict(best[path, name]) if (path, name) in best else dict(optimizer.params)
+            params['max_iter'] = optimizer.params['max_iter']
+            tuned[name] = type(optimizer)(**params)
+        with open(os.path.join(out_dir, os.path.basename(path)), 'w') as f:
+            f.write(format_config(tuned))
+    return rounds
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the step sizes of Config files by successive halving")
+    parser.add_argument('configs', nargs='+', help="Config files whose optimizers are tuned")
+    parser.add_argument('--out', required=True, help="Directory the tuned Config files are written to")
+    parser.add_argument('--dataset', default='Data/real-sim')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--threads-per-worker', type=int, default=None)
+    parser.add_argument('--min-iter', type=int, default=20, help="Smallest budget of a round")
+    parser.add_argument('--max-iter', type=int, default=1000, help="Budget of the last round")
+    parser.add_argument('--eta', type=int, default=3, help="Budget growth and pruning factor per round")
+    args = parser.parse_args()
+    
+    rounds = tune_configs(args.configs, args.out, args.dataset, args.workers, args.threads_per_worker,
+                          args.min_iter, args.max_iter, args.eta)
+    runs = sum(len(search['results']) for round in rounds for search in round.values())
+    print(f"{len(rounds)} rounds, {runs} runs; configs written to {args.out}")
+
+if __name__ == "__main__":
+    main()